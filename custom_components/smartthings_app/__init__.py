@@ -1,16 +1,30 @@
 import logging
+import voluptuous as vol
 
-from homeassistant.core import HomeAssistant
+from homeassistant.core import HomeAssistant, ServiceCall
 from homeassistant.config_entries import ConfigEntry
+from homeassistant.exceptions import ( ConfigEntryNotReady, HomeAssistantError )
+from homeassistant.helpers import entity_registry as er
+from homeassistant.helpers.service import async_extract_entity_ids
+import homeassistant.helpers.config_validation as cv
 
 from .smartthings import SmartThings
 from .const import (
    DOMAIN,
-   PLATFORMS
+   PLATFORMS,
+   OPTION_DEADBAND,
+   OPTION_MIN_WRITE_INTERVAL,
+   SERVICE_SET_WRITE_OPTIONS
 )
 
 _LOGGER = logging.getLogger(__name__)
 
+# An empty value goes back to the unit default, 0 turns the throttle off
+SET_WRITE_OPTIONS_SCHEMA = cv.make_entity_service_schema({
+    vol.Optional(OPTION_DEADBAND): vol.Any(None, vol.All(vol.Coerce(float), vol.Range(min=0))),
+    vol.Optional(OPTION_MIN_WRITE_INTERVAL): vol.Any(None, vol.All(vol.Coerce(float), vol.Range(min=0)))
+})
+
 async def async_setup_entry(hass: HomeAssistant, config: ConfigEntry):
 
     smartthings = SmartThings(hass, config)
@@ -18,22 +32,88 @@ async def async_setup_entry(hass: HomeAssistant, config: ConfigEntry):
     hass.data.setdefault(DOMAIN, {})
     hass.data[DOMAIN][config.entry_id] = smartthings
 
-    devices = {}
+    smartthings.schedule_token_refresh()
+
+    if not hass.services.has_service(DOMAIN, SERVICE_SET_WRITE_OPTIONS):
+        async_register_services(hass)
+
+    cached = await smartthings.async_load_cache()
+    # Without a cache the devices are loaded in the background and the platforms add them page by page
+    config.async_create_background_task(hass, async_refresh_devices(smartthings, cached), "smartthings_app_refresh")
 
     try:
-        devices = await smartthings.get_devices()
+        has_devices = await smartthings.async_wait_for_devices()
 #     except ConfigEntryAuthFailed as e:
 #         raise ConfigEntryAuthFailed from e
     except Exception as e:
-        _LOGGER.error(str(e))
-#         await stellantis.close_session()
-        devices = {}
+        # Let Home Assistant retry the setup instead of ending up without devices
+        hass.data[DOMAIN].pop(config.entry_id)
+        smartthings.cancel_token_refresh()
+        raise ConfigEntryNotReady(str(e)) from e
 
-    for device in devices:
-        coordinator = await smartthings.async_get_coordinator(device)
-#         await coordinator.async_config_entry_first_refresh()
-
-    if devices:
+    if has_devices:
+        # Platforms only add the pages loaded so far and follow the rest, setup doesn't wait for the full list
+        smartthings.register_webhook()
         await hass.config_entries.async_forward_entry_setups(config, PLATFORMS)
+        smartthings.platforms = PLATFORMS
+
+    config.async_on_unload(config.add_update_listener(async_update_options))
 
     return True
+
+
+def async_register_services(hass: HomeAssistant):
+    async def async_set_write_options(call: ServiceCall):
+        registry = er.async_get(hass)
+        for entity_id in await async_extract_entity_ids(hass, call):
+            registry_entry = registry.async_get(entity_id)
+            if registry_entry is None or registry_entry.platform != DOMAIN:
+                raise HomeAssistantError(f"{entity_id} is not a SmartThings App entity")
+
+            # Read by the entity on every update, no reload needed
+            options = dict(registry_entry.options.get(DOMAIN, {}))
+            for name in [OPTION_DEADBAND, OPTION_MIN_WRITE_INTERVAL]:
+                if name not in call.data:
+                    continue
+                if call.data[name] is None:
+                    options.pop(name, None)
+                else:
+                    options[name] = call.data[name]
+            registry.async_update_entity_options(entity_id, DOMAIN, options)
+
+    hass.services.async_register(DOMAIN, SERVICE_SET_WRITE_OPTIONS, async_set_write_options, SET_WRITE_OPTIONS_SCHEMA)
+
+
+async def async_update_options(hass: HomeAssistant, config: ConfigEntry):
+    # Token refreshes update the entry data too, only an options change needs a reload
+    smartthings = hass.data[DOMAIN].get(config.entry_id)
+    if smartthings and dict(config.options) != smartthings.loaded_options:
+        await hass.config_entries.async_reload(config.entry_id)
+
+
+async def async_refresh_devices(smartthings, cached):
+    if cached:
+        # Entities were built from the cache, bring them up to date with the cloud
+        await smartthings.async_revalidate()
+    else:
+        try:
+            await smartthings.async_load_devices()
+        except Exception as e:
+            # Reported to the setup while no device is ready, the pages already added stay
+            _LOGGER.error(f"Devices load failed: {str(e)}")
+            return
+    if await smartthings.async_wait_for_devices():
+        await smartthings.async_reconcile_subscriptions()
+
+
+async def async_unload_entry(hass: HomeAssistant, config: ConfigEntry):
+    smartthings = hass.data[DOMAIN][config.entry_id]
+    unload_ok = await hass.config_entries.async_unload_platforms(config, smartthings.platforms)
+    if unload_ok:
+        hass.data[DOMAIN].pop(config.entry_id)
+        await smartthings.async_unload()
+    return unload_ok
+
+
+async def async_remove_entry(hass: HomeAssistant, config: ConfigEntry):
+    await SmartThings(hass, config).async_remove_cache()
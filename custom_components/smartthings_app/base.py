@@ -1,31 +1,128 @@
 import logging
-from datetime import ( datetime, UTC )
+from datetime import ( datetime, timedelta, UTC )
 from dateutil.relativedelta import relativedelta
-import re
+import time
 
 from homeassistant.core import callback
 from homeassistant.helpers.update_coordinator import ( CoordinatorEntity, DataUpdateCoordinator )
-from homeassistant.helpers.event import ( async_track_state_change, async_track_point_in_time )
+from homeassistant.helpers.event import ( async_track_state_change, async_track_point_in_time, async_call_later )
 from homeassistant.components.sensor import ( RestoreSensor, SensorStateClass, SensorDeviceClass )
 from homeassistant.components.number import NumberEntity
 from homeassistant.helpers.restore_state import RestoreEntity
 from homeassistant.util import dt
 from homeassistant.components.binary_sensor import BinarySensorEntity
+from homeassistant.components.switch import SwitchEntity
 
+from .models import ( AttributeState, intern_key, get_capability_family )
+from .capabilities import ( build_entities, index_entities, get_profile_key, camel_to_snake, camel_to_name )
 from .const import (
-   DOMAIN
+   DOMAIN,
+   POLL_INTERVAL_FAST,
+   POLL_INTERVAL_DEFAULT,
+   POLL_INTERVAL_IDLE,
+   DEVICE_ACTIVE_WINDOW,
+   DEVICE_IDLE_AFTER,
+   PRIORITY_POLL,
+   OPTION_DEADBAND,
+   OPTION_MIN_WRITE_INTERVAL,
+   DEFAULT_WRITE_OPTIONS
 )
 _LOGGER = logging.getLogger(__name__)
 
 class SmartthingsCoordinator(DataUpdateCoordinator):
     def __init__(self, hass, device, smartthings):
-        super().__init__(hass, _LOGGER, name = DOMAIN)
+        super().__init__(hass, _LOGGER, name = DOMAIN, update_interval = POLL_INTERVAL_DEFAULT, always_update = False)
 
         self._hass = hass
         self._device = device
         self._smartthings = smartthings
         self._device_components = {}
         self._device_entities = {}
+        self._device_entity_index = {}
+        self._attribute_entities = {}
+        self._entity_listeners = {}
+        self._pending_updates = {}
+        self._flush_scheduled = False
+        self._last_change = None
+        self._next_full_refresh = None
+        self._next_capability_refresh = {}
+
+
+    async def _async_update_data(self):
+        now = time.monotonic()
+        if self._next_full_refresh is None or now >= self._next_full_refresh:
+            request = await self._smartthings.get_polled_device_status(self._device["deviceId"], PRIORITY_POLL)
+            self.apply_status_updates(self.parse_device_status(request))
+            self._next_full_refresh = now + self.get_full_refresh_interval().total_seconds()
+            self._next_capability_refresh = {}
+        else:
+            for (component_name, capability_name), due in list(self._next_capability_refresh.items()):
+                if now < due:
+                    continue
+                request = await self._smartthings.get_capability_status(self._device["deviceId"], component_name, capability_name, PRIORITY_POLL)
+                self.apply_status_updates({component_name: {capability_name: self.parse_capability_status(request)}})
+                self._next_capability_refresh[(component_name, capability_name)] = now + self.get_capability_tiers()[capability_name]
+
+        self.schedule_next_refresh()
+
+        # Same object as before: listeners are only notified through the flush of real changes
+        return self._device_components
+
+
+    def apply_status_updates(self, device_components):
+        updates = self.get_status_updates(device_components)
+        if updates:
+            self.async_apply_updates(updates)
+            self._smartthings.register_device_attributes(self)
+
+
+    def get_capability_tiers(self):
+        return self._smartthings.get_capability_refresh_tiers()
+
+
+    def get_full_refresh_interval(self):
+        if self._last_change is None:
+            return POLL_INTERVAL_DEFAULT
+
+        idle = time.monotonic() - self._last_change
+        if idle > DEVICE_IDLE_AFTER.total_seconds():
+            return POLL_INTERVAL_IDLE
+        # Hot capabilities have their own tier, the full status stays slow
+        if idle < DEVICE_ACTIVE_WINDOW.total_seconds() and not self._next_capability_refresh:
+            return POLL_INTERVAL_FAST
+        return POLL_INTERVAL_DEFAULT
+
+
+    def schedule_next_refresh(self):
+        now = time.monotonic()
+        tiers = self.get_capability_tiers()
+        for component_name, component_data in self._device_components.items():
+            for capability_name in component_data:
+                if capability_name in tiers:
+                    self._next_capability_refresh.setdefault((component_name, capability_name), now + tiers[capability_name])
+
+        if self._next_full_refresh is None:
+            self._next_full_refresh = now + self.get_full_refresh_interval().total_seconds()
+
+        next_refresh = min([self._next_full_refresh] + list(self._next_capability_refresh.values()))
+        self.update_interval = timedelta(seconds=max(1, next_refresh - now))
+
+
+    def get_status_updates(self, device_components):
+        updates = {}
+        for component_name, component_data in device_components.items():
+            for capability_name, capability_data in component_data.items():
+                previous_capability = self._device_components.get(component_name, {}).get(capability_name, {})
+                for attribute_name, item_data in capability_data.items():
+                    previous = previous_capability.get(attribute_name)
+                    if previous is not None:
+                        if previous.timestamp is not None and item_data.timestamp is not None:
+                            if previous.timestamp == item_data.timestamp:
+                                continue
+                        elif previous.value == item_data.value:
+                            continue
+                    updates[(component_name, capability_name, attribute_name)] = item_data
+        return updates
 
 
     async def get_device_components(self):
@@ -33,229 +130,183 @@ class SmartthingsCoordinator(DataUpdateCoordinator):
             return self._device_components
 
         request = await self._smartthings.get_device_status(self._device["deviceId"])
+        return self.set_device_status(request)
+
+
+    def set_device_status(self, request):
+        device_components = self.parse_device_status(request)
+        if self._device_components:
+            # Already known, from the cache or a previous load: only apply what changed
+            self.apply_status_updates(device_components)
+            return self._device_components
+        return self.load_device_components(device_components)
+
+
+    def load_device_components(self, device_components):
+        self._device_components.update(device_components)
+        _LOGGER.error(self._device_components)
+        self._smartthings.register_device_attributes(self)
+        self.schedule_next_refresh()
+        return self._device_components
+
+
+    def parse_device_status(self, request):
+        result = {}
         device_components = request["components"]
+        denied_capabilities, allowed_capabilities, allowed_families = self._smartthings.capability_filter
 
-        disabled_components = []
+        disabled_components = frozenset()
         if "main" in device_components and "custom.disabledComponents" in device_components["main"]:
-            disabled_components = disabled_components + device_components["main"]["custom.disabledComponents"]["disabledComponents"]["value"]
-            del device_components["main"]["custom.disabledComponents"]
+            disabled_components = frozenset(device_components["main"]["custom.disabledComponents"]["disabledComponents"]["value"] or [])
 
         for component_name, component_data in device_components.items():
             if component_name in disabled_components:
                 continue
 
-            component_result = {}
-
-            disabled_capabilities = [
-                "ocf",
-                "execute",
-                "refresh",
-                "samsungce.deviceIdentification",
-                "samsungce.remoteManagementData",
-                "samsungce.softwareUpdate",
-                "samsungce.driverVersion",
-                "samsungce.viewInside",
-                "samsungce.quickControl",
-                "samsungvd.thingStatus",
-                "samsungvd.firmwareVersion",
-                "samsungvd.deviceCategory",
-                "samsungvd.supportsPowerOnByOcf",
-                "sec.diagnosticsInformation",
-                "custom.energyType"
-            ]
-            if "custom.disabledCapabilities" in component_data:
-                disabled_capabilities = disabled_capabilities + component_data["custom.disabledCapabilities"]["disabledCapabilities"]["value"]
-                del component_data["custom.disabledCapabilities"]
-            if "samsungce.unavailableCapabilities" in component_data:
-                disabled_capabilities = disabled_capabilities + component_data["samsungce.unavailableCapabilities"]["unavailableCommands"]["value"]
-                del component_data["samsungce.unavailableCapabilities"]
+            # Device reported lists are merged with the configured deny list once per component
+            disabled_capabilities = denied_capabilities
+            if "custom.disabledCapabilities" in component_data or "samsungce.unavailableCapabilities" in component_data:
+                disabled_capabilities = disabled_capabilities.union(
+                    (component_data.get("custom.disabledCapabilities", {}).get("disabledCapabilities", {}).get("value") or []),
+                    (component_data.get("samsungce.unavailableCapabilities", {}).get("unavailableCommands", {}).get("value") or [])
+                )
 
+            component_result = {}
             for capability_name, capability_data in component_data.items():
-                capability_result = {}
                 if capability_name in disabled_capabilities:
                     continue
-                for item_name, item_data in capability_data.items():
-                    if "value" in item_data and item_data["value"] in [None]:
-                        continue
-                    capability_result.update({item_name: item_data})
-                component_result.update({capability_name: capability_result})
+                if allowed_capabilities and capability_name not in allowed_capabilities:
+                    continue
+                if allowed_families and get_capability_family(capability_name) not in allowed_families:
+                    continue
+                component_result.update({intern_key(capability_name): self.parse_capability_status(capability_data)})
 
             if component_result:
-                self._device_components.update({component_name: component_result})
+                result.update({intern_key(component_name): component_result})
+
+        return result
 
-        _LOGGER.error(self._device_components)
-        return self._device_components
+
+    def parse_capability_status(self, capability_data):
+        capability_result = {}
+        for item_name, item_data in capability_data.items():
+            if item_data.get("value") is None:
+                continue
+            capability_result.update({intern_key(item_name): AttributeState.from_dict(item_data)})
+        return capability_result
+
+
+    def get_device_attributes(self):
+        for component_name, component_data in self._device_components.items():
+            for capability_name, capability_data in component_data.items():
+                for attribute_name in capability_data:
+                    yield (component_name, capability_name, attribute_name)
+
+
+    @callback
+    def async_apply_updates(self, updates):
+        for (component_name, capability_name, attribute_name), item_data in updates.items():
+            component_data = self._device_components.setdefault(component_name, {})
+            component_data.setdefault(capability_name, {})[attribute_name] = item_data
+        self._pending_updates.update(updates)
+        self._last_change = time.monotonic()
+
+        # Coalesce every update received in this loop iteration into a single write
+        if not self._flush_scheduled:
+            self._flush_scheduled = True
+            self._hass.loop.call_soon(self._async_flush_updates)
+
+
+    @callback
+    def _async_flush_updates(self):
+        self._flush_scheduled = False
+        if not self._pending_updates:
+            return
+        updates = self._pending_updates
+        self._pending_updates = {}
+
+        # Only the entities bound to a changed attribute are converted and written, in one pass
+        changed_entities = {}
+        for key, item_data in updates.items():
+            for entity in self._attribute_entities.get(key, []):
+                try:
+                    entity["value"] = entity["convert"](item_data)
+                except Exception as e:
+                    # One malformed value must not hold back the rest of the flush
+                    _LOGGER.warning(f"Unable to convert {key} of {self._device['deviceId']} for {entity['name']}: {e}")
+            for listener in self._entity_listeners.get(key, []):
+                changed_entities[listener] = None
+        for listener in changed_entities:
+            listener.async_handle_attribute_update()
+        self._smartthings.save_cache()
+
+
+    @callback
+    def async_add_entity_listener(self, key, listener):
+        self._entity_listeners.setdefault(key, []).append(listener)
+
+        @callback
+        def remove_listener():
+            self._entity_listeners[key].remove(listener)
+            if not self._entity_listeners[key]:
+                del self._entity_listeners[key]
+
+        return remove_listener
 
 
     def camel_to_snake(self, name):
-        name = name.replace(".", "_")
-        name = re.sub('(.)([A-Z][a-z]+)', r'\1_\2', name)
-        return re.sub('([a-z0-9])([A-Z])', r'\1_\2', name).lower()
+        return camel_to_snake(name)
 
 
     def camel_to_name(self, name):
-        name = self.camel_to_snake(name)
-        name = name.replace("_", " ")
-        return name.title()
+        return camel_to_name(name)
 
 
     async def get_device_entities(self, type):
-        if self._device_entities:
-            return self._device_entities.get(type, [])
+        if not self._device_entities:
+            await self.get_device_components()
+            self.build_device_entities()
+        return self._device_entities.get(type, [])
 
-        entities = {
-            "switch": [],
-            "sensor": [],
-            "binary_sensor": []
-        }
-        components = await self.get_device_components()
-
-        for module, items in components.items():
-            for item_name, item_data in items.items():
-
-                if item_name == "switch":
-                    entities["switch"].append({
-#                         "name": f"{module}-{self.camel_to_snake(item_name)}",
-                        "name": self.camel_to_name(f"{module} {item_name}"),
-                        "value": item_data["switch"]["value"] == "on",
-                        "module": module,
-                        "capability": item_name
-                    })
-                    continue
 
-                if item_name == "samsungce.consumedEnergy":
-                    value = 0
-                    for months in item_data["monthlyUsage"]["value"]:
-                        if months["month"] == datetime.now().strftime("%Y-%m"):
-                            value = months["consumedEnergy"]
-                    entities["sensor"].append({
-                        "name": self.camel_to_name("monthlyUsage"),
-                        "value": value,
-                        "module": module,
-                        "capability": item_name,
-                        "property": "monthlyUsage",
-                        "unit_of_measurement": "kWh"
-                    })
-                    continue
+    def get_capability_definitions(self):
+        definitions = {}
+        for component in self._device.get("components", []):
+            for capability in component.get("capabilities", []):
+                definition = self._smartthings.get_capability_definition(capability["id"], capability.get("version", 1))
+                if definition:
+                    definitions[capability["id"]] = definition
+        return definitions
 
-                if item_name == "powerConsumptionReport":
-                    items = item_data["powerConsumption"]["value"]
-                    entities["sensor"].append({
-                        "name": self.camel_to_name("energy"),
-                        "value": items["energy"],
-                        "module": module,
-                        "capability": item_name,
-                        "property": "powerConsumption_energy",
-                        "unit_of_measurement": "Wh"
-                    })
-                    entities["sensor"].append({
-                        "name": self.camel_to_name("deltaEnergy"),
-                        "value": items["deltaEnergy"],
-                        "module": module,
-                        "capability": item_name,
-                        "property": "powerConsumption_deltaEnergy",
-                        "unit_of_measurement": "Wh"
-                    })
-                    entities["sensor"].append({
-                        "name": self.camel_to_name("power"),
-                        "value": items["power"],
-                        "module": module,
-                        "capability": item_name,
-                        "property": "powerConsumption_power",
-                        "unit_of_measurement": "W"
-                    })
-                    entities["sensor"].append({
-                        "name": self.camel_to_name("powerEnergy"),
-                        "value": items["powerEnergy"],
-                        "module": module,
-                        "capability": item_name,
-                        "property": "powerConsumption_powerEnergy",
-                        "unit_of_measurement": "Wh"
-                    })
-                    entities["sensor"].append({
-                        "name": self.camel_to_name("persistedEnergy"),
-                        "value": items["persistedEnergy"],
-                        "module": module,
-                        "capability": item_name,
-                        "property": "powerConsumption_persistedEnergy",
-                        "unit_of_measurement": "Wh"
-                    })
-                    entities["sensor"].append({
-                        "name": self.camel_to_name("energySaved"),
-                        "value": items["energySaved"],
-                        "module": module,
-                        "capability": item_name,
-                        "property": "powerConsumption_energySaved",
-                        "unit_of_measurement": "Wh"
-                    })
-                    entities["sensor"].append({
-                        "name": self.camel_to_name("persistedSavedEnergy"),
-                        "value": items["persistedSavedEnergy"],
-                        "module": module,
-                        "capability": item_name,
-                        "property": "powerConsumption_persistedSavedEnergy",
-                        "unit_of_measurement": "Wh"
-                    })
-                    continue
 
-                for sub_item_name, sub_item_data in item_data.items():
-
-                    if isinstance(sub_item_data["value"], list) and len(sub_item_data["value"]) == 1:
-                        sub_item_data["value"] = sub_item_data["value"][0]
-
-                    if isinstance(sub_item_data["value"], bool) or (isinstance(sub_item_data["value"], str) and sub_item_data["value"] in ["on", "off", "open", "closed", "true", "false", "muted", "unmuted"]):
-                        value = True
-                        if isinstance(sub_item_data["value"], bool):
-                            value = sub_item_data["value"]
-                        elif sub_item_data["value"] in ["off",  "open", "true", "unmuted"]:
-                            value = False
-
-                        name = item_name
-
-                        if len(item_name.split(".")) > 1:
-                            name = item_name.split(".")[1]
-
-                        if module != "main":
-                            name = f"{module} {name}"
-
-                        if isinstance(sub_item_data["value"], str) and not sub_item_name in ["contact", "mute", "remoteControlEnabled"]:
-                            name = f"{name} {sub_item_name}"
-
-                        name = name.replace("contactSensor", "Closed")
-
-                        entities["binary_sensor"].append({
-#                             "name": f"{module}-{self.camel_to_snake(item_name)}-{self.camel_to_snake(sub_item_name)}",
-                            "name": self.camel_to_name(name),
-                            "value": value,
-                            "module": module,
-                            "capability": item_name,
-                            "property": sub_item_name
-                        })
-                    elif isinstance(sub_item_data["value"], list):
-                        continue
-                    elif isinstance(sub_item_data["value"], dict):
-                        continue
-                    else:
-                        name = sub_item_name
-                        if module != "main":
-                            name = f"{module} {name}"
-                        value = sub_item_data["value"]
-                        if isinstance(sub_item_data["value"], str):
-                            value = sub_item_data["value"].title()
-                        data = {
-#                             "name": f"{module}-{self.camel_to_snake(item_name)}-{self.camel_to_snake(sub_item_name)}",
-                            "name": self.camel_to_name(name),
-                            "value": str(value),
-                            "module": module,
-                            "capability": item_name,
-                            "property": sub_item_name
-                        }
-                        if "unit" in sub_item_data:
-                            data["unit_of_measurement"] = sub_item_data["unit"]
-                        entities["sensor"].append(data)
+    async def async_send_command(self, component, capability, attribute, command, value, arguments = None):
+        key = (component, capability, attribute)
+        previous = self._device_components.get(component, {}).get(capability, {}).get(attribute)
+
+        # Optimistic: the next event or status refresh reconciles the real value
+        self.async_apply_updates({key: AttributeState(value, previous.unit if previous else None)})
+        try:
+            await self._smartthings.async_send_command(self._device["deviceId"], component, capability, command, arguments)
+        except Exception:
+            if previous is not None:
+                self.async_apply_updates({key: previous})
+            raise
+
 
+    def get_device_entity(self, type, name):
+        return self._device_entity_index.get((type, name))
+
+
+    def build_device_entities(self):
+        entities = build_entities(self._device_components, get_profile_key(self._device), self.get_capability_definitions())
         self._device_entities = entities
-        return entities.get(type, [])
+        self._device_entity_index = {
+            (type, entity["name"]): entity
+            for type, type_entities in entities.items()
+            for entity in type_entities
+        }
+        self._attribute_entities = index_entities(entities)
+        return entities
 
 
 
@@ -277,6 +328,102 @@ class SmartthingsBase(CoordinatorEntity):
 #         self._attr_suggested_display_precision = 2
         self._attr_translation_key = description.translation_key
         self._attr_has_entity_name = True
+        # State write throttling
+        self._last_write = None
+        self._last_available = None
+        self._pending_write = None
+        self._pending_value = None
+
+    async def async_added_to_hass(self) -> None:
+        await super().async_added_to_hass()
+        entity = self._coordinator.get_device_entity(self._entity_type, self.entity_description.key)
+        if entity:
+            self.async_on_remove(self._coordinator.async_add_entity_listener(
+                (entity["module"], entity["capability"], entity["attribute"]), self
+            ))
+
+    @callback
+    def _handle_coordinator_update(self) -> None:
+        # Coordinator wide updates only change availability, values come through async_handle_attribute_update
+        self.async_handle_attribute_update()
+
+    @callback
+    def async_handle_attribute_update(self):
+        entity = self._coordinator.get_device_entity(self._entity_type, self.entity_description.key)
+        if not entity:
+            super()._handle_coordinator_update()
+            return
+        self.async_update_value(entity["value"])
+
+    def get_write_options(self):
+        options = dict(DEFAULT_WRITE_OPTIONS.get(getattr(self, "_attr_native_unit_of_measurement", None), {}))
+        if self.registry_entry:
+            options.update(self.registry_entry.options.get(DOMAIN, {}))
+        return options
+
+    def is_within_deadband(self, value, options):
+        deadband = options.get(OPTION_DEADBAND)
+        if not deadband:
+            return False
+        try:
+            return abs(float(value) - float(self.current_value)) < float(deadband)
+        except (TypeError, ValueError):
+            return False
+
+    @callback
+    def async_update_value(self, value):
+        if self._pending_write is not None and self.available == self._last_available:
+            # Compared to the published state, so a value going back never lets a stale one out
+            if value == self.current_value or self.is_within_deadband(value, self.get_write_options()):
+                self.cancel_pending_write()
+            else:
+                self._pending_value = value
+            return
+
+        if value == self.current_value and self.available == self._last_available:
+            return
+
+        # Availability changes are written right away, with whatever value is latest
+        if value != self.current_value and self.available == self._last_available:
+            options = self.get_write_options()
+            if self.is_within_deadband(value, options):
+                return
+
+            min_interval = options.get(OPTION_MIN_WRITE_INTERVAL)
+            if min_interval and self._last_write is not None:
+                wait = self._last_write + float(min_interval) - time.monotonic()
+                if wait > 0:
+                    # Keep only the latest value, written once the interval is over
+                    self._pending_value = value
+                    self._pending_write = async_call_later(self.hass, wait, self._async_write_pending)
+                    return
+
+        self.set_value(value)
+        self._async_write_value_state()
+
+    @callback
+    def cancel_pending_write(self):
+        if self._pending_write is not None:
+            self._pending_write()
+            self._pending_write = None
+        self._pending_value = None
+
+    @callback
+    def _async_write_pending(self, now):
+        self._pending_write = None
+        self.set_value(self._pending_value)
+        self._async_write_value_state()
+
+    @callback
+    def _async_write_value_state(self):
+        self.cancel_pending_write()
+        self._last_write = time.monotonic()
+        self._last_available = self.available
+        self.async_write_ha_state()
+
+    async def async_will_remove_from_hass(self) -> None:
+        self.cancel_pending_write()
+        await super().async_will_remove_from_hass()
 
     @property
     def device_info(self):
@@ -298,6 +445,8 @@ class SmartthingsBase(CoordinatorEntity):
         }
 
 class SmartthingsSensor(SmartthingsBase, RestoreSensor):
+    _entity_type = "sensor"
+
     def __init__(self, coordinator, description, default_value = None):
         super().__init__(coordinator, description)
 
@@ -307,9 +456,48 @@ class SmartthingsSensor(SmartthingsBase, RestoreSensor):
         if hasattr(description, "unit_of_measurement"):
             self._attr_native_unit_of_measurement = description.unit_of_measurement
 
+    @property
+    def current_value(self):
+        return self._attr_native_value
+
+    def set_value(self, value):
+        self._attr_native_value = value
+
 
 class SmartthingsBinarySensor(SmartthingsBase, BinarySensorEntity):
+    _entity_type = "binary_sensor"
+
     def __init__(self, coordinator, description, default_value):
         super().__init__(coordinator, description)
 
-        self._attr_is_on = default_value
\ No newline at end of file
+        self._attr_is_on = default_value
+
+    @property
+    def current_value(self):
+        return self._attr_is_on
+
+    def set_value(self, value):
+        self._attr_is_on = value
+
+
+class SmartthingsSwitch(SmartthingsBase, SwitchEntity):
+    _entity_type = "switch"
+
+    def __init__(self, coordinator, description, entity):
+        super().__init__(coordinator, description)
+
+        self._module = entity["module"]
+        self._attr_is_on = entity["value"]
+
+    @property
+    def current_value(self):
+        return self._attr_is_on
+
+    def set_value(self, value):
+        self._attr_is_on = value
+
+    async def async_turn_on(self, **kwargs):
+        await self._coordinator.async_send_command(self._module, "switch", "switch", "on", "on")
+
+    async def async_turn_off(self, **kwargs):
+        await self._coordinator.async_send_command(self._module, "switch", "switch", "off", "off")
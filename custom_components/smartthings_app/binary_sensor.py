@@ -14,20 +14,22 @@ _LOGGER = logging.getLogger(__name__)
 async def async_setup_entry(hass: HomeAssistant, config: ConfigEntry, async_add_entities):
     smartthings = hass.data[DOMAIN][config.entry_id]
 
-    entities = []
-
-    devices = await smartthings.get_devices()
-
-    for device in devices:
-        coordinator = await smartthings.async_get_coordinator(device)
-        sensors = await coordinator.get_device_entities("binary_sensor")
-        _LOGGER.error(sensors)
-        for sensor in sensors:
-            description = BinarySensorEntityDescription(
-                key = sensor["name"],
-                name = sensor["name"],
-                translation_key = sensor["name"]
-            )
-            entities.extend([SmartthingsBinarySensor(coordinator, description, sensor["value"])])
-
-    async_add_entities(entities)
\ No newline at end of file
+
+    async def async_add_page(devices):
+        entities = []
+        for device in devices:
+            coordinator = await smartthings.async_get_coordinator(device)
+            sensors = await coordinator.get_device_entities("binary_sensor")
+            _LOGGER.error(sensors)
+            for sensor in sensors:
+                description = BinarySensorEntityDescription(
+                    key = sensor["name"],
+                    name = sensor["name"],
+                    translation_key = sensor["name"]
+                )
+                entities.extend([SmartthingsBinarySensor(coordinator, description, sensor["value"])])
+
+        async_add_entities(entities)
+
+    # Entities of later pages are added as the background load publishes them
+    config.async_on_unload(smartthings.async_subscribe_device_pages(async_add_page))
@@ -0,0 +1,316 @@
+import re
+from datetime import datetime
+from functools import lru_cache
+
+FIRST_CAP_RE = re.compile('(.)([A-Z][a-z]+)')
+ALL_CAP_RE = re.compile('([a-z0-9])([A-Z])')
+
+BINARY_VALUES = frozenset(["on", "off", "open", "closed", "true", "false", "muted", "unmuted"])
+BINARY_OFF_VALUES = frozenset(["off",  "open", "true", "unmuted"])
+# String binary attributes named after their capability only
+BINARY_CAPABILITY_NAMED = frozenset(["contact", "mute", "remoteControlEnabled"])
+
+
+@lru_cache(maxsize=None)
+def camel_to_snake(name):
+    name = name.replace(".", "_")
+    name = FIRST_CAP_RE.sub(r'\1_\2', name)
+    return ALL_CAP_RE.sub(r'\1_\2', name).lower()
+
+
+@lru_cache(maxsize=None)
+def camel_to_name(name):
+    name = camel_to_snake(name)
+    name = name.replace("_", " ")
+    return name.title()
+
+
+def current_month_usage(value):
+    month = datetime.now().strftime("%Y-%m")
+    for months in value:
+        if months["month"] == month:
+            return months["consumedEnergy"]
+    return 0
+
+
+# Capabilities with a dedicated layout, every other one goes through the generic attribute mapping.
+# "name" may contain {module}, "key" picks a field of a dict value, "value" converts the raw value.
+CAPABILITY_TABLE = {
+    "switch": [
+        {"type": "switch", "attribute": "switch", "name": "{module} switch", "value": lambda value: value == "on"}
+    ],
+    "samsungce.consumedEnergy": [
+        {"type": "sensor", "attribute": "monthlyUsage", "name": "monthlyUsage", "unit": "kWh", "value": current_month_usage}
+    ],
+    "powerConsumptionReport": [
+        {"type": "sensor", "attribute": "powerConsumption", "key": "energy", "name": "energy", "unit": "Wh"},
+        {"type": "sensor", "attribute": "powerConsumption", "key": "deltaEnergy", "name": "deltaEnergy", "unit": "Wh"},
+        {"type": "sensor", "attribute": "powerConsumption", "key": "power", "name": "power", "unit": "W"},
+        {"type": "sensor", "attribute": "powerConsumption", "key": "powerEnergy", "name": "powerEnergy", "unit": "Wh"},
+        {"type": "sensor", "attribute": "powerConsumption", "key": "persistedEnergy", "name": "persistedEnergy", "unit": "Wh"},
+        {"type": "sensor", "attribute": "powerConsumption", "key": "energySaved", "name": "energySaved", "unit": "Wh"},
+        {"type": "sensor", "attribute": "powerConsumption", "key": "persistedSavedEnergy", "name": "persistedSavedEnergy", "unit": "Wh"}
+    ]
+}
+
+
+def compile_capability_table(table):
+    dispatch = {}
+    for capability_name, specs in table.items():
+        compiled = []
+        for spec in specs:
+            entry = dict(spec)
+            if "property" not in entry and entry["type"] != "switch":
+                entry["property"] = f"{spec['attribute']}_{spec['key']}" if "key" in spec else spec["attribute"]
+            # Static names are resolved once here, module dependent ones are memoized per module
+            entry["static_name"] = None if "{module}" in spec["name"] else camel_to_name(spec["name"])
+            entry["convert"] = compile_converter(spec.get("key"), spec.get("value"))
+            compiled.append(entry)
+        dispatch[capability_name] = tuple(compiled)
+    return dispatch
+
+
+def compile_converter(key, convert):
+    def converter(item_data):
+        value = item_data.value
+        if key is not None:
+            value = value[key]
+        if convert is not None:
+            value = convert(value)
+        return value
+    return converter
+
+
+def get_item_value(item_data):
+    value = item_data.value
+    if isinstance(value, list) and len(value) == 1:
+        value = item_data.value = value[0]
+    return value
+
+
+def convert_bool(item_data):
+    return get_item_value(item_data)
+
+
+def convert_binary(item_data):
+    return get_item_value(item_data) not in BINARY_OFF_VALUES
+
+
+def convert_sensor(item_data):
+    value = get_item_value(item_data)
+    if isinstance(value, str):
+        value = value.title()
+    return str(value)
+
+
+CAPABILITY_DISPATCH = compile_capability_table(CAPABILITY_TABLE)
+
+# Entity layouts shared by devices with the same profile and the same reported attributes
+TEMPLATE_CACHE = {}
+TEMPLATE_CACHE_SIZE = 256
+
+
+@lru_cache(maxsize=None)
+def module_name(template, module):
+    return camel_to_name(template.format(module=module))
+
+
+@lru_cache(maxsize=None)
+def binary_sensor_name(module, capability_name, attribute_name, string_value):
+    name = capability_name
+    if "." in capability_name:
+        name = capability_name.split(".")[1]
+    if module != "main":
+        name = f"{module} {name}"
+    if string_value and attribute_name not in BINARY_CAPABILITY_NAMED:
+        name = f"{name} {attribute_name}"
+    name = name.replace("contactSensor", "Closed")
+    return camel_to_name(name)
+
+
+@lru_cache(maxsize=None)
+def sensor_name(module, attribute_name):
+    if module != "main":
+        return camel_to_name(f"{module} {attribute_name}")
+    return camel_to_name(attribute_name)
+
+
+def get_profile_key(device):
+    if device.get("profile", {}).get("id"):
+        return device["profile"]["id"]
+    if device.get("deviceProfileId"):
+        return device["deviceProfileId"]
+    return (device.get("manufacturerName"), device.get("ocf", {}).get("modelNumber"), device.get("presentationId"))
+
+
+def get_attribute_definition(definitions, capability_name, attribute_name):
+    if not definitions or capability_name not in definitions:
+        return None
+    return definitions[capability_name].get("attributes", {}).get(attribute_name)
+
+
+def get_attribute_kind(item_data, attribute_definition = None):
+    value = get_item_value(item_data)
+    if value is None:
+        return None
+
+    if attribute_definition:
+        properties = attribute_definition.get("schema", {}).get("properties", {})
+        value_schema = properties.get("value", {})
+        value_type = value_schema.get("type")
+        if value_type == "boolean" and isinstance(value, bool):
+            return "bool"
+        if value_type == "string" and "enum" in value_schema and isinstance(value, str):
+            if BINARY_VALUES.issuperset(value_schema["enum"]):
+                return "binary"
+            return ("sensor", item_data.unit)
+        if value_type in ["number", "integer"] and isinstance(value, (int, float)):
+            unit = item_data.unit
+            if unit is None and "unit" in properties:
+                units = properties["unit"].get("enum", [])
+                unit = properties["unit"].get("default") or (units[0] if len(units) == 1 else None)
+            return ("sensor", unit)
+        if value_type in ["array", "object"]:
+            return None
+
+    # No definition, or one that doesn't match the value: guess from the value
+    if isinstance(value, bool):
+        return "bool"
+    if isinstance(value, str) and value in BINARY_VALUES:
+        return "binary"
+    if isinstance(value, (list, dict)):
+        return None
+    return ("sensor", item_data.unit)
+
+
+def build_table_slots(slots, module, capability_name, capability_data, specs):
+    for spec in specs:
+        if spec["attribute"] not in capability_data:
+            continue
+        entity = {
+            "name": spec["static_name"] or module_name(spec["name"], module),
+            "module": module,
+            "capability": capability_name,
+            "attribute": spec["attribute"]
+        }
+        if "property" in spec:
+            entity["property"] = spec["property"]
+        if "unit" in spec:
+            entity["unit_of_measurement"] = spec["unit"]
+        entity["convert"] = spec["convert"]
+        slots.append((spec["type"], entity, None))
+
+
+def build_attribute_slot(slots, module, capability_name, attribute_name, item_data, definitions):
+    kind = get_attribute_kind(item_data, get_attribute_definition(definitions, capability_name, attribute_name))
+    if kind is None:
+        return
+
+    entity = {
+        "module": module,
+        "capability": capability_name,
+        "attribute": attribute_name,
+        "property": attribute_name
+    }
+    if kind in ["bool", "binary"]:
+        entity["name"] = binary_sensor_name(module, capability_name, attribute_name, kind == "binary")
+        entity["convert"] = convert_bool if kind == "bool" else convert_binary
+        slots.append(("binary_sensor", entity, kind))
+        return
+
+    entity["name"] = sensor_name(module, attribute_name)
+    if kind[1] is not None:
+        entity["unit_of_measurement"] = kind[1]
+    entity["convert"] = convert_sensor
+    slots.append(("sensor", entity, kind))
+
+
+def build_slots(components, definitions):
+    slots = []
+    for module, capabilities in components.items():
+        for capability_name, capability_data in capabilities.items():
+            specs = CAPABILITY_DISPATCH.get(capability_name)
+            if specs is not None:
+                build_table_slots(slots, module, capability_name, capability_data, specs)
+                continue
+            for attribute_name, item_data in capability_data.items():
+                build_attribute_slot(slots, module, capability_name, attribute_name, item_data, definitions)
+    return tuple(slots)
+
+
+class DeviceEntity:
+    # The static record is shared by every device bound to the same template, only the value is per device
+    __slots__ = ("static", "value")
+
+    def __init__(self, static, value):
+        self.static = static
+        self.value = value
+
+    def __getitem__(self, key):
+        if key == "value":
+            return self.value
+        return self.static[key]
+
+    def __setitem__(self, key, value):
+        if key != "value":
+            raise KeyError(key)
+        self.value = value
+
+    def get(self, key, default = None):
+        if key == "value":
+            return self.value
+        return self.static.get(key, default)
+
+    def __repr__(self):
+        return repr(dict(self.static, value=self.value))
+
+
+def bind_slots(slots, components, definitions):
+    entities = {
+        "switch": [],
+        "sensor": [],
+        "binary_sensor": []
+    }
+    for type, static, kind in slots:
+        item_data = components[static["module"]][static["capability"]][static["attribute"]]
+        # Kinds from a definition hold for the whole profile, guessed ones depend on the value
+        if kind is not None and get_attribute_definition(definitions, static["capability"], static["attribute"]) is None:
+            if get_attribute_kind(item_data) != kind:
+                # Same profile but a differently shaped value: the template doesn't apply
+                return None
+        entities[type].append(DeviceEntity(static, static["convert"](item_data)))
+    return entities
+
+
+def index_entities(entities):
+    index = {}
+    for type, type_entities in entities.items():
+        for entity in type_entities:
+            index.setdefault((entity["module"], entity["capability"], entity["attribute"]), []).append(entity)
+    return index
+
+
+def get_template_key(profile_key, components):
+    return (profile_key, tuple(
+        (module, capability_name, tuple(capability_data))
+        for module, capabilities in components.items()
+        for capability_name, capability_data in capabilities.items()
+    ))
+
+
+def build_entities(components, profile_key = None, definitions = None):
+    if profile_key is None:
+        return bind_slots(build_slots(components, definitions), components, definitions)
+
+    key = get_template_key(profile_key, components)
+    slots = TEMPLATE_CACHE.get(key)
+    if slots is not None:
+        entities = bind_slots(slots, components, definitions)
+        if entities is not None:
+            return entities
+
+    slots = build_slots(components, definitions)
+    if len(TEMPLATE_CACHE) >= TEMPLATE_CACHE_SIZE:
+        TEMPLATE_CACHE.pop(next(iter(TEMPLATE_CACHE)))
+    TEMPLATE_CACHE[key] = slots
+    return bind_slots(slots, components, definitions)
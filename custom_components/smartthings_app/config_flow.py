@@ -5,14 +5,28 @@ from aiohttp import web_response
 import time
 
 from homeassistant import config_entries
+from homeassistant.core import callback
 from homeassistant.const import CONF_WEBHOOK_ID
 from homeassistant.components.http import KEY_HASS, HomeAssistantView
 from homeassistant.helpers.network import get_url
+import homeassistant.helpers.config_validation as cv
 
 from .smartthings import SmartThings
 from .const import (
     DOMAIN,
     FIELD_PERSONAL_TOKEN,
+    OPTION_EXCLUDED_CAPABILITIES,
+    OPTION_INCLUDED_CAPABILITIES,
+    OPTION_CAPABILITY_FAMILIES,
+    OPTION_LOCATIONS,
+    OPTION_ROOMS,
+    OPTION_DEVICE_TYPES,
+    OPTION_STATUS_CONCURRENCY,
+    OPTION_BULK_STATUS,
+    OPTION_CAPABILITY_REFRESH_TIERS,
+    OPTION_MAX_CONNECTIONS,
+    DEFAULT_STATUS_CONCURRENCY,
+    DEFAULT_MAX_CONNECTIONS,
     AUTH_RETURN_URL_PATH,
     AUTH_RETURN_URL_NAME
 )
@@ -30,6 +44,12 @@ class ConfigFlow(config_entries.ConfigFlow, domain=DOMAIN):
     VERSION = 1
     MINOR_VERSION = 1
 
+    @staticmethod
+    @callback
+    def async_get_options_flow(config_entry):
+        """Get the options flow for this handler."""
+        return OptionsFlowHandler()
+
     def __init__(self):
         """Initialize config flow."""
         self.errors = {}
@@ -98,6 +118,8 @@ class ConfigFlow(config_entries.ConfigFlow, domain=DOMAIN):
             "refresh_token": access_token_request["refresh_token"],
             "expires_in": time.time() + int(access_token_request["expires_in"])
         })
+        if "installed_app_id" in access_token_request:
+            self.data.update({"installed_app_id": access_token_request["installed_app_id"]})
 
         return self.async_external_step_done(next_step_id="finalize")
 
@@ -110,6 +132,40 @@ class ConfigFlow(config_entries.ConfigFlow, domain=DOMAIN):
         return self.async_create_entry(title=(await self.smartthings.get_location_name()), data=self.data)
 
 
+class OptionsFlowHandler(config_entries.OptionsFlow):
+    """Handle the options."""
+
+    async def async_step_init(self, user_input=None):
+        """Manage the device and capability filters and the request settings."""
+        if user_input is not None:
+            return self.async_create_entry(data=user_input)
+
+        errors = {}
+        smartthings = self.hass.data.get(DOMAIN, {}).get(self.config_entry.entry_id) or SmartThings(self.hass, self.config_entry)
+        try:
+            choices = await smartthings.async_get_filter_choices()
+        except Exception as e:
+            _LOGGER.error(str(e))
+            errors["base"] = "cannot_connect"
+            choices = {name: {} for name in [OPTION_LOCATIONS, OPTION_ROOMS, OPTION_DEVICE_TYPES, OPTION_CAPABILITY_FAMILIES]}
+
+        options = self.config_entry.options
+        schema = {}
+        # Empty selections mean everything is loaded
+        for name in [OPTION_LOCATIONS, OPTION_ROOMS, OPTION_DEVICE_TYPES, OPTION_CAPABILITY_FAMILIES]:
+            selected = [value for value in options.get(name, []) if value in choices[name]]
+            schema[vol.Optional(name, default=selected)] = cv.multi_select(choices[name])
+        schema[vol.Optional(OPTION_EXCLUDED_CAPABILITIES, default=options.get(OPTION_EXCLUDED_CAPABILITIES, ""))] = str
+        schema[vol.Optional(OPTION_INCLUDED_CAPABILITIES, default=options.get(OPTION_INCLUDED_CAPABILITIES, ""))] = str
+        schema[vol.Optional(OPTION_BULK_STATUS, default=options.get(OPTION_BULK_STATUS, False))] = bool
+        schema[vol.Optional(OPTION_STATUS_CONCURRENCY, default=options.get(OPTION_STATUS_CONCURRENCY, DEFAULT_STATUS_CONCURRENCY))] = vol.All(vol.Coerce(int), vol.Range(min=1, max=50))
+        schema[vol.Optional(OPTION_MAX_CONNECTIONS, default=options.get(OPTION_MAX_CONNECTIONS, DEFAULT_MAX_CONNECTIONS))] = vol.All(vol.Coerce(int), vol.Range(min=1, max=50))
+        # Overrides of the default tiers, "capability=seconds" separated by commas
+        schema[vol.Optional(OPTION_CAPABILITY_REFRESH_TIERS, default=options.get(OPTION_CAPABILITY_REFRESH_TIERS, ""))] = str
+
+        return self.async_show_form(step_id="init", data_schema=vol.Schema(schema), errors=errors)
+
+
 class ConfigFlowCallbackView(HomeAssistantView):
     """Handle callback from external auth."""
 
@@ -1,9 +1,142 @@
+from datetime import timedelta
+from aiohttp import ClientTimeout
+
 DOMAIN = "smartthings_app"
 
 # PLATFORMS = ["sensor", "number"]
-PLATFORMS = ["sensor", "binary_sensor"]
+PLATFORMS = ["sensor", "binary_sensor", "switch"]
 
 FIELD_PERSONAL_TOKEN = "personal_token"
+FIELD_SIGNATURE_TYPE = "signature_type"
+
+OPTION_EXCLUDED_CAPABILITIES = "excluded_capabilities"
+OPTION_INCLUDED_CAPABILITIES = "included_capabilities"
+OPTION_CAPABILITY_FAMILIES = "capability_families"
+OPTION_LOCATIONS = "locations"
+OPTION_ROOMS = "rooms"
+OPTION_DEVICE_TYPES = "device_types"
+# The cached devices and components only depend on the filters
+FILTER_OPTIONS = [
+    OPTION_EXCLUDED_CAPABILITIES,
+    OPTION_INCLUDED_CAPABILITIES,
+    OPTION_CAPABILITY_FAMILIES,
+    OPTION_LOCATIONS,
+    OPTION_ROOMS,
+    OPTION_DEVICE_TYPES
+]
+
+OPTION_STATUS_CONCURRENCY = "status_concurrency"
+OPTION_BULK_STATUS = "bulk_status"
+OPTION_CAPABILITY_REFRESH_TIERS = "capability_refresh_tiers"
+OPTION_MAX_CONNECTIONS = "max_connections"
+
+# Entity registry options, per entity, set through the set_write_options service
+OPTION_DEADBAND = "deadband"
+OPTION_MIN_WRITE_INTERVAL = "min_write_interval"
+SERVICE_SET_WRITE_OPTIONS = "set_write_options"
+
+# Write throttling applied by unit unless the entity options say otherwise
+DEFAULT_WRITE_OPTIONS = {
+    "W": {OPTION_MIN_WRITE_INTERVAL: 10}
+}
+
+# Never turned into entities
+DISABLED_CAPABILITIES = frozenset([
+    "ocf",
+    "execute",
+    "refresh",
+    "samsungce.deviceIdentification",
+    "samsungce.remoteManagementData",
+    "samsungce.softwareUpdate",
+    "samsungce.driverVersion",
+    "samsungce.viewInside",
+    "samsungce.quickControl",
+    "samsungvd.thingStatus",
+    "samsungvd.firmwareVersion",
+    "samsungvd.deviceCategory",
+    "samsungvd.supportsPowerOnByOcf",
+    "sec.diagnosticsInformation",
+    "custom.energyType",
+    # Status markers listing what the device disabled, consumed by the filter itself
+    "custom.disabledComponents",
+    "custom.disabledCapabilities",
+    "samsungce.unavailableCapabilities"
+])
+
+DEFAULT_STATUS_CONCURRENCY = 8
+DEFAULT_MAX_CONNECTIONS = 10
+
+REQUEST_TIMEOUT = ClientTimeout(total=30, connect=10)
+
+# Conservative client side budget, the X-RateLimit-* response headers tighten it when needed
+RATE_LIMIT_REQUESTS = 250
+RATE_LIMIT_PERIOD = 60
+RATE_LIMIT_BURST = 20
+
+RETRY_ATTEMPTS = 4
+RETRY_BASE_DELAY = 1
+RETRY_MAX_DELAY = 30
+IDEMPOTENT_METHODS = ["GET", "PUT", "DELETE"]
+
+# A family of endpoints fails fast after this many consecutive failures
+CIRCUIT_FAILURE_THRESHOLD = 5
+CIRCUIT_RESET_TIMEOUT = 60
+
+# Lower values are served first
+PRIORITY_COMMAND = 0
+PRIORITY_TOKEN = 0
+PRIORITY_DEFAULT = 1
+PRIORITY_POLL = 2
+PRIORITY_PREFETCH = 3
+
+STORAGE_VERSION = 1
+STORAGE_KEY = DOMAIN
+CACHE_SAVE_DELAY = 60
+CAPABILITY_CACHE_SIZE = 512
+# Seconds before a capability definition that failed to load is requested again
+CAPABILITY_RETRY_DELAY = 86400
+
+# Commands sent to the same device within this window go out in one request
+COMMAND_COALESCE_WINDOW = 0.05
+
+# Access tokens are refreshed in the background this long before they expire
+TOKEN_REFRESH_MARGIN = timedelta(minutes=5)
+TOKEN_REFRESH_RETRY = timedelta(minutes=1)
+
+# Adaptive polling: devices that changed recently are polled fast, idle ones back off
+POLL_INTERVAL_FAST = timedelta(seconds=30)
+POLL_INTERVAL_DEFAULT = timedelta(minutes=5)
+POLL_INTERVAL_IDLE = timedelta(minutes=30)
+DEVICE_ACTIVE_WINDOW = timedelta(minutes=10)
+DEVICE_IDLE_AFTER = timedelta(hours=2)
+
+# With bulk status, one device list with status serves every device polled within this many seconds
+BULK_STATUS_MAX_AGE = 30
+
+# Capabilities refreshed on their own through the capability status endpoint, in seconds
+DEFAULT_CAPABILITY_REFRESH_TIERS = {
+    "powerMeter": 30,
+    "powerConsumptionReport": 60,
+    "energyMeter": 60,
+    "voltageMeasurement": 60,
+    "currentMeasurement": 60
+}
+
+# Webhook events waiting for the background worker, newer events are dropped once full
+WEBHOOK_QUEUE_SIZE = 100
+
+# Webhook requests are signed by SmartThings with the keys published on its key server
+SIGNATURE_TYPE = "ST_PADLOCK"
+SIGNATURE_KEY_URL = "https://key.smartthings.com"
+SIGNATURE_KEY_TTL = 86400
+# Unknown or unreachable key ids are not fetched again for a while
+SIGNATURE_KEY_RETRY = 300
+SIGNATURE_KEY_TIMEOUT = ClientTimeout(total=10)
+SIGNATURE_MAX_SKEW = 300
+
+# SmartThings allows at most 20 subscriptions per installed app
+SUBSCRIPTION_LIMIT = 20
+SUBSCRIPTION_NAME_MAX_LENGTH = 36
 
 API_BASE_URL = "https://api.smartthings.com"
 SCOPES = [
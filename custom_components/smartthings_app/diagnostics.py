@@ -0,0 +1,32 @@
+from homeassistant.core import HomeAssistant
+from homeassistant.config_entries import ConfigEntry
+from homeassistant.const import CONF_WEBHOOK_ID
+from homeassistant.components.diagnostics import async_redact_data
+
+from .const import (
+   DOMAIN,
+   FIELD_PERSONAL_TOKEN
+)
+
+TO_REDACT = [
+    FIELD_PERSONAL_TOKEN,
+    CONF_WEBHOOK_ID,
+    "access_token",
+    "refresh_token",
+    "client_id",
+    "client_secret",
+    "app_webhook_url"
+]
+
+
+async def async_get_config_entry_diagnostics(hass: HomeAssistant, config: ConfigEntry):
+    smartthings = hass.data[DOMAIN][config.entry_id]
+    return {
+        "entry": async_redact_data(dict(config.data), TO_REDACT),
+        "options": dict(config.options),
+        "devices": len(smartthings._devices),
+        # Queue waits per request priority, lower is more urgent
+        "requests": {str(priority): stats for priority, stats in smartthings.request_stats.items()},
+        "circuits": smartthings.circuit_states,
+        "webhook": smartthings.webhook_stats
+    }
@@ -0,0 +1,142 @@
+import sys
+
+# Fields of the /v1/devices payload the integration reads, everything else is dropped on load
+DEVICE_FIELDS = [
+    "deviceId",
+    "name",
+    "label",
+    "manufacturerName",
+    "presentationId",
+    "deviceProfileId",
+    "locationId",
+    "roomId",
+    "type"
+]
+OCF_FIELDS = ["modelNumber", "firmwareVersion"]
+
+
+class AttributeState:
+    __slots__ = ("value", "unit", "timestamp")
+
+    def __init__(self, value, unit = None, timestamp = None):
+        self.value = value
+        self.unit = sys.intern(unit) if isinstance(unit, str) else unit
+        self.timestamp = timestamp
+
+    @classmethod
+    def from_dict(cls, data):
+        return cls(data.get("value"), data.get("unit"), data.get("timestamp"))
+
+    @classmethod
+    def from_cache(cls, data):
+        if isinstance(data, dict):
+            return cls.from_dict(data)
+        return cls(*data)
+
+    def as_cache(self):
+        return [self.value, self.unit, self.timestamp]
+
+    def as_dict(self):
+        data = {"value": self.value}
+        if self.unit is not None:
+            data["unit"] = self.unit
+        if self.timestamp is not None:
+            data["timestamp"] = self.timestamp
+        return data
+
+
+def intern_key(name):
+    return sys.intern(name)
+
+
+def compact_device(device):
+    result = {name: device[name] for name in DEVICE_FIELDS if name in device}
+    if device.get("profile", {}).get("id"):
+        result["profile"] = {"id": device["profile"]["id"]}
+    if "ocf" in device:
+        result["ocf"] = {name: device["ocf"][name] for name in OCF_FIELDS if name in device["ocf"]}
+    result["components"] = [
+        {
+            "id": intern_key(component["id"]),
+            "capabilities": [
+                {"id": intern_key(capability["id"]), "version": capability.get("version", 1)}
+                for capability in component.get("capabilities", [])
+            ],
+            "categories": [
+                {"name": category["name"]}
+                for category in component.get("categories", []) if "name" in category
+            ]
+        }
+        for component in device.get("components", [])
+    ]
+    return result
+
+
+def get_device_type(device):
+    for component in device.get("components", []):
+        if component.get("id") == "main" and component.get("categories"):
+            return component["categories"][0].get("name")
+    return device.get("type")
+
+
+def get_capability_family(capability_name):
+    # Namespaced capabilities (samsungce.*, custom.*) belong to their namespace, the rest are standard
+    if "." in capability_name:
+        return capability_name.split(".")[0]
+    return "standard"
+
+
+def components_from_cache(data):
+    return {
+        intern_key(component_name): {
+            intern_key(capability_name): {
+                intern_key(attribute_name): AttributeState.from_cache(item_data)
+                for attribute_name, item_data in capability_data.items()
+            }
+            for capability_name, capability_data in component_data.items()
+        }
+        for component_name, component_data in data.items()
+    }
+
+
+def components_as_cache(components):
+    return {
+        component_name: {
+            capability_name: {
+                attribute_name: item_data.as_cache()
+                for attribute_name, item_data in capability_data.items()
+            }
+            for capability_name, capability_data in component_data.items()
+        }
+        for component_name, component_data in components.items()
+    }
+
+
+def components_as_dict(components):
+    return {
+        component_name: {
+            capability_name: {
+                attribute_name: item_data.as_dict()
+                for attribute_name, item_data in capability_data.items()
+            }
+            for capability_name, capability_data in component_data.items()
+        }
+        for component_name, component_data in components.items()
+    }
+
+
+def deep_getsizeof(obj, seen = None):
+    if seen is None:
+        seen = set()
+    if id(obj) in seen:
+        return 0
+    seen.add(id(obj))
+
+    size = sys.getsizeof(obj)
+    if isinstance(obj, dict):
+        size = size + sum(deep_getsizeof(key, seen) + deep_getsizeof(value, seen) for key, value in obj.items())
+    elif isinstance(obj, (list, tuple, set, frozenset)):
+        size = size + sum(deep_getsizeof(item, seen) for item in obj)
+    elif hasattr(obj, "__slots__"):
+        size = size + sum(deep_getsizeof(getattr(obj, name), seen) for name in obj.__slots__ if hasattr(obj, name))
+    return size
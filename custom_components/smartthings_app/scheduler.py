@@ -0,0 +1,143 @@
+import logging
+import asyncio
+import heapq
+import itertools
+import time
+
+from .const import (
+    RATE_LIMIT_REQUESTS,
+    RATE_LIMIT_PERIOD,
+    RATE_LIMIT_BURST,
+    CIRCUIT_FAILURE_THRESHOLD,
+    CIRCUIT_RESET_TIMEOUT
+)
+
+_LOGGER = logging.getLogger(__name__)
+
+# Token bucket in front of the SmartThings API, queued requests are served by priority
+class RequestScheduler:
+    def __init__(self, requests = RATE_LIMIT_REQUESTS, period = RATE_LIMIT_PERIOD, burst = RATE_LIMIT_BURST):
+        self._rate = requests / period
+        self._capacity = burst
+        self._tokens = burst
+        self._updated = time.monotonic()
+        self._blocked_until = 0
+        self._queue = []
+        self._counter = itertools.count()
+        self._dispatcher = None
+        self._stats = {}
+
+
+    async def acquire(self, priority):
+        start = time.monotonic()
+        future = asyncio.get_running_loop().create_future()
+        heapq.heappush(self._queue, (priority, next(self._counter), future))
+        if self._dispatcher is None or self._dispatcher.done():
+            self._dispatcher = asyncio.create_task(self._dispatch())
+        await future
+        self.record_wait(priority, time.monotonic() - start)
+
+
+    async def _dispatch(self):
+        while self._queue:
+            now = time.monotonic()
+            self._tokens = min(self._capacity, self._tokens + (now - self._updated) * self._rate)
+            self._updated = now
+
+            if now < self._blocked_until:
+                await asyncio.sleep(self._blocked_until - now)
+                continue
+            if self._tokens < 1:
+                await asyncio.sleep((1 - self._tokens) / self._rate)
+                continue
+
+            priority, counter, future = heapq.heappop(self._queue)
+            if future.done():
+                # Caller went away while queued
+                continue
+            self._tokens = self._tokens - 1
+            future.set_result(None)
+
+
+    def update_from_headers(self, headers):
+        try:
+            if "X-RateLimit-Remaining" in headers:
+                remaining = int(headers["X-RateLimit-Remaining"])
+                self._tokens = min(self._tokens, remaining)
+                # SmartThings reports the reset as milliseconds left in the current window
+                if remaining <= 0 and "X-RateLimit-Reset" in headers:
+                    self.block(int(headers["X-RateLimit-Reset"]) / 1000)
+        except ValueError:
+            _LOGGER.debug(f"Invalid rate limit headers: {dict(headers)}")
+
+
+    def block(self, seconds):
+        self._blocked_until = max(self._blocked_until, time.monotonic() + seconds)
+        self._tokens = 0
+
+
+    def record_wait(self, priority, wait):
+        stats = self._stats.setdefault(priority, {"requests": 0, "total_wait": 0, "max_wait": 0})
+        stats["requests"] = stats["requests"] + 1
+        stats["total_wait"] = stats["total_wait"] + wait
+        stats["max_wait"] = max(stats["max_wait"], wait)
+        if wait > 1:
+            _LOGGER.debug(f"Request with priority {priority} waited {wait:.2f}s in queue ({len(self._queue)} queued)")
+
+
+    @property
+    def stats(self):
+        return {
+            priority: {
+                "requests": stats["requests"],
+                "average_wait": stats["total_wait"] / stats["requests"],
+                "max_wait": stats["max_wait"]
+            }
+            for priority, stats in self._stats.items()
+        }
+
+
+# Closed while the endpoints answer, open after repeated failures, half open to probe recovery
+class CircuitBreaker:
+    def __init__(self, name, failure_threshold = CIRCUIT_FAILURE_THRESHOLD, reset_timeout = CIRCUIT_RESET_TIMEOUT):
+        self._name = name
+        self._failure_threshold = failure_threshold
+        self._reset_timeout = reset_timeout
+        self._failures = 0
+        self._opened_at = None
+        self._probing = False
+
+
+    def allow(self):
+        if self._opened_at is None:
+            return True
+        if time.monotonic() - self._opened_at < self._reset_timeout:
+            return False
+        # Let a single request through to probe the endpoints, the next one waits another timeout
+        self._opened_at = time.monotonic()
+        self._probing = True
+        return True
+
+
+    @property
+    def state(self):
+        if self._opened_at is None:
+            return "closed"
+        return "half_open" if self._probing else "open"
+
+
+    def record_success(self):
+        if self._opened_at is not None:
+            _LOGGER.info(f"SmartThings {self._name} endpoints recovered")
+        self._failures = 0
+        self._opened_at = None
+        self._probing = False
+
+
+    def record_failure(self):
+        self._failures = self._failures + 1
+        if self._probing or self._failures >= self._failure_threshold:
+            if self._opened_at is None or self._probing:
+                _LOGGER.warning(f"SmartThings {self._name} endpoints failing, pausing requests for {self._reset_timeout}s")
+            self._opened_at = time.monotonic()
+            self._probing = False
@@ -16,9 +16,6 @@ _LOGGER = logging.getLogger(__name__)
 async def async_setup_entry(hass: HomeAssistant, config: ConfigEntry, async_add_entities):
     smartthings = hass.data[DOMAIN][config.entry_id]
 
-    entities = []
-
-    devices = await smartthings.get_devices()
 
     unit_map = {
         "C": {
@@ -46,21 +43,26 @@ async def async_setup_entry(hass: HomeAssistant, config: ConfigEntry, async_add_
         }
     }
 
-    for device in devices:
-        coordinator = await smartthings.async_get_coordinator(device)
-        sensors = await coordinator.get_device_entities("sensor")
-        _LOGGER.error(sensors)
-        for sensor in sensors:
-            default_config = unit_map.get(sensor.get("unit_of_measurement", None), {})
-            description = SensorEntityDescription(
-                key = sensor["name"],
-                name = sensor["name"],
-                translation_key = sensor["name"],
-                unit_of_measurement = default_config.get("unit_of_measurement", None),
-                icon = default_config.get("icon", None),
-                device_class = default_config.get("device_class", None),
-                suggested_display_precision = default_config.get("suggested_display_precision", None)
-            )
-            entities.extend([SmartthingsSensor(coordinator, description, sensor["value"])])
+    async def async_add_page(devices):
+        entities = []
+        for device in devices:
+            coordinator = await smartthings.async_get_coordinator(device)
+            sensors = await coordinator.get_device_entities("sensor")
+            _LOGGER.error(sensors)
+            for sensor in sensors:
+                default_config = unit_map.get(sensor.get("unit_of_measurement", None), {})
+                description = SensorEntityDescription(
+                    key = sensor["name"],
+                    name = sensor["name"],
+                    translation_key = sensor["name"],
+                    unit_of_measurement = default_config.get("unit_of_measurement", None),
+                    icon = default_config.get("icon", None),
+                    device_class = default_config.get("device_class", None),
+                    suggested_display_precision = default_config.get("suggested_display_precision", None)
+                )
+                entities.extend([SmartthingsSensor(coordinator, description, sensor["value"])])
+
+        async_add_entities(entities)
 
-    async_add_entities(entities)
\ No newline at end of file
+    # Entities of later pages are added as the background load publishes them
+    config.async_on_unload(smartthings.async_subscribe_device_pages(async_add_page))
@@ -0,0 +1,192 @@
+import logging
+import asyncio
+import base64
+import hashlib
+import re
+import time
+from collections import OrderedDict
+from email.utils import parsedate_to_datetime
+
+from cryptography.exceptions import InvalidSignature
+from cryptography.hazmat.primitives import hashes
+from cryptography.hazmat.primitives.asymmetric import padding
+from cryptography.hazmat.primitives.serialization import load_pem_public_key
+from cryptography.x509 import load_pem_x509_certificate
+
+from .const import (
+    SIGNATURE_KEY_URL,
+    SIGNATURE_KEY_TTL,
+    SIGNATURE_KEY_RETRY,
+    SIGNATURE_KEY_TIMEOUT,
+    SIGNATURE_MAX_SKEW
+)
+
+_LOGGER = logging.getLogger(__name__)
+
+# SmartThings padlock keys: /pl/<region>/<colon or dash separated hex fingerprint>
+KEY_ID_RE = re.compile(r"^/pl/[a-z0-9]+/[0-9a-f]{2}([-:][0-9a-f]{2})+$", re.IGNORECASE)
+SIGNATURE_PARAM_RE = re.compile(r'(\w+)="([^"]*)"')
+# Without these the date and the body could be swapped under a captured signature
+REQUIRED_SIGNED_HEADERS = frozenset(["(request-target)", "date", "digest"])
+
+
+def parse_signature_header(header):
+    if not header or not header.startswith("Signature "):
+        return None
+    params = dict(SIGNATURE_PARAM_RE.findall(header))
+    if "keyId" not in params or "signature" not in params:
+        return None
+    params["headers"] = params.get("headers", "date").lower().split()
+    return params
+
+
+def load_public_key(data):
+    # SmartThings serves its keys as certificates, plain public keys are accepted too
+    if b"CERTIFICATE" in data:
+        return load_pem_x509_certificate(data).public_key()
+    return load_pem_public_key(data)
+
+
+def verify_rsa_signature(public_key, signature, signing_string):
+    try:
+        public_key.verify(signature, signing_string, padding.PKCS1v15(), hashes.SHA256())
+    except InvalidSignature:
+        return False
+    return True
+
+
+# HTTP signatures on webhook requests, cheap checks first, the RSA verification runs in the executor
+class SignatureVerifier:
+    def __init__(self, hass, session, key_url = SIGNATURE_KEY_URL, key_ttl = SIGNATURE_KEY_TTL, max_skew = SIGNATURE_MAX_SKEW):
+        self._hass = hass
+        self._session = session
+        self._key_url = key_url
+        self._key_ttl = key_ttl
+        self._max_skew = max_skew
+        self._keys = {}
+        self._failed_keys = {}
+        self._key_fetches = {}
+        self._seen_signatures = OrderedDict()
+
+
+    async def verify(self, request, body):
+        params = parse_signature_header(request.headers.get("Authorization"))
+        if params is None:
+            _LOGGER.warning("Rejected unsigned webhook request")
+            return False
+
+        if not REQUIRED_SIGNED_HEADERS.issubset(params["headers"]):
+            _LOGGER.warning(f"Rejected webhook request signing only {params['headers']}")
+            return False
+
+        if not self.is_date_valid(request.headers.get("Date")):
+            _LOGGER.warning("Rejected webhook request with a missing or stale date")
+            return False
+
+        if not self.is_digest_valid(request.headers.get("Digest"), body):
+            _LOGGER.warning("Rejected webhook request with a mismatching digest")
+            return False
+
+        signing_string = self.get_signing_string(request, params["headers"])
+        if signing_string is None:
+            _LOGGER.warning("Rejected webhook request missing signed headers")
+            return False
+
+        if not KEY_ID_RE.match(params["keyId"]):
+            _LOGGER.warning(f"Rejected webhook request with an unexpected key id {params['keyId']}")
+            return False
+
+        # Reserved before the first await, a concurrent copy of the same request is a replay too
+        if self.is_replayed(params["signature"]):
+            _LOGGER.warning("Rejected replayed webhook request")
+            return False
+        self.record_signature(params["signature"])
+
+        try:
+            signature = base64.b64decode(params["signature"])
+            public_key = await self.get_public_key(params["keyId"])
+            verified = await self._hass.async_add_executor_job(verify_rsa_signature, public_key, signature, signing_string)
+        except Exception as error:
+            _LOGGER.warning(f"Unable to verify webhook signature: {error}")
+            verified = False
+
+        if not verified:
+            self._seen_signatures.pop(params["signature"], None)
+            _LOGGER.warning(f"Rejected webhook request with an invalid signature from {params['keyId']}")
+        return verified
+
+
+    def is_date_valid(self, date):
+        if not date:
+            return False
+        try:
+            timestamp = parsedate_to_datetime(date).timestamp()
+        except (TypeError, ValueError):
+            return False
+        return abs(time.time() - timestamp) <= self._max_skew
+
+
+    def is_replayed(self, signature):
+        now = time.monotonic()
+        # Same lifetime for every entry: the oldest ones are always first
+        while self._seen_signatures and next(iter(self._seen_signatures.values())) < now:
+            self._seen_signatures.popitem(last=False)
+        return signature in self._seen_signatures
+
+
+    def record_signature(self, signature):
+        # A request older than the allowed skew is rejected by its date, no need to remember it longer
+        self._seen_signatures[signature] = time.monotonic() + 2 * self._max_skew
+
+
+    def is_digest_valid(self, digest, body):
+        if not digest or not digest.startswith("SHA-256="):
+            return False
+        return digest[8:] == base64.b64encode(hashlib.sha256(body).digest()).decode()
+
+
+    def get_signing_string(self, request, header_names):
+        lines = []
+        for name in header_names:
+            if name == "(request-target)":
+                lines.append(f"(request-target): {request.method.lower()} {request.path_qs}")
+            elif name in request.headers:
+                lines.append(f"{name}: {request.headers[name]}")
+            else:
+                return None
+        return "\n".join(lines).encode()
+
+
+    async def get_public_key(self, key_id):
+        now = time.monotonic()
+        cached = self._keys.get(key_id)
+        if cached is not None and cached[1] > now:
+            return cached[0]
+        if self._failed_keys.get(key_id, 0) > now:
+            raise ValueError(f"Key {key_id} recently unavailable")
+
+        # One fetch per key id, requests signed with the same key wait for it
+        fetch = self._key_fetches.get(key_id)
+        if fetch is None:
+            fetch = self._hass.async_create_task(self._async_fetch_public_key(key_id))
+            self._key_fetches[key_id] = fetch
+        return await asyncio.shield(fetch)
+
+
+    async def _async_fetch_public_key(self, key_id):
+        try:
+            async with self._session.get(f"{self._key_url}{key_id}", timeout=SIGNATURE_KEY_TIMEOUT) as response:
+                response.raise_for_status()
+                data = await response.read()
+            public_key = await self._hass.async_add_executor_job(load_public_key, data)
+        except Exception:
+            now = time.monotonic()
+            self._failed_keys = {failed_id: until for failed_id, until in self._failed_keys.items() if until > now}
+            self._failed_keys[key_id] = now + SIGNATURE_KEY_RETRY
+            raise
+        finally:
+            self._key_fetches.pop(key_id, None)
+
+        self._keys[key_id] = (public_key, time.monotonic() + self._key_ttl)
+        _LOGGER.debug(f"Loaded webhook signing key {key_id}")
+        return public_key
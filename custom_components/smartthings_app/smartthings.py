@@ -1,46 +1,165 @@
 import logging
-import aiohttp
+import asyncio
+from aiohttp import web
 import base64
-import json
-from copy import deepcopy
+import hashlib
+import random
+import aiohttp
 # import urllib.parse
 import base64
 import time
+from collections import OrderedDict
+
+try:
+    from orjson import loads as json_loads
+except ImportError:
+    from json import loads as json_loads
 
 from homeassistant.const import CONF_WEBHOOK_ID
 from homeassistant.components.webhook import DOMAIN as WEBHOOK_DOMAIN
 from homeassistant.helpers.network import get_url
+from homeassistant.helpers.aiohttp_client import async_get_clientsession
 from homeassistant.components import webhook
+from homeassistant.helpers.event import async_track_point_in_time
+from homeassistant.util import dt
+from homeassistant.helpers.storage import Store
+from homeassistant.helpers.dispatcher import ( async_dispatcher_connect, async_dispatcher_send )
+from homeassistant.core import callback
 
 from .base import SmartthingsCoordinator
+from .models import ( AttributeState, compact_device, get_device_type, get_capability_family, components_from_cache, components_as_cache, components_as_dict, deep_getsizeof )
+from .scheduler import ( RequestScheduler, CircuitBreaker )
+from .signature import SignatureVerifier
 from .const import (
     DOMAIN,
     FIELD_PERSONAL_TOKEN,
+    OPTION_STATUS_CONCURRENCY,
+    OPTION_BULK_STATUS,
+    BULK_STATUS_MAX_AGE,
+    OPTION_CAPABILITY_REFRESH_TIERS,
+    DEFAULT_CAPABILITY_REFRESH_TIERS,
+    FILTER_OPTIONS,
+    OPTION_MAX_CONNECTIONS,
+    OPTION_EXCLUDED_CAPABILITIES,
+    OPTION_INCLUDED_CAPABILITIES,
+    OPTION_CAPABILITY_FAMILIES,
+    OPTION_LOCATIONS,
+    OPTION_ROOMS,
+    OPTION_DEVICE_TYPES,
+    DISABLED_CAPABILITIES,
+    DEFAULT_MAX_CONNECTIONS,
+    REQUEST_TIMEOUT,
+    RETRY_ATTEMPTS,
+    RETRY_BASE_DELAY,
+    RETRY_MAX_DELAY,
+    IDEMPOTENT_METHODS,
+    PRIORITY_TOKEN,
+    PRIORITY_COMMAND,
+    PRIORITY_DEFAULT,
+    PRIORITY_POLL,
+    PRIORITY_PREFETCH,
+    DEFAULT_STATUS_CONCURRENCY,
+    TOKEN_REFRESH_MARGIN,
+    TOKEN_REFRESH_RETRY,
+    STORAGE_VERSION,
+    STORAGE_KEY,
+    CACHE_SAVE_DELAY,
+    CAPABILITY_CACHE_SIZE,
+    CAPABILITY_RETRY_DELAY,
+    COMMAND_COALESCE_WINDOW,
+    WEBHOOK_QUEUE_SIZE,
+    FIELD_SIGNATURE_TYPE,
+    SIGNATURE_TYPE,
+    SUBSCRIPTION_LIMIT,
+    SUBSCRIPTION_NAME_MAX_LENGTH,
     API_BASE_URL,
     SCOPES
 )
 
 _LOGGER = logging.getLogger(__name__)
 
+class SmartThingsApiError(Exception):
+    pass
+
+class SmartThingsRetryableError(SmartThingsApiError):
+    def __init__(self, message, retry_after = None):
+        super().__init__(message)
+        self.retry_after = retry_after
+
+class SmartThingsRateLimitError(SmartThingsRetryableError):
+    pass
+
+class SmartThingsServerError(SmartThingsRetryableError):
+    pass
+
+class SmartThingsCircuitOpenError(SmartThingsApiError):
+    pass
+
+def get_subscription_name(location_id, capability_name):
+    # Capability names don't fit the length limit and share long prefixes, the hash keeps them apart
+    digest = hashlib.sha1(f"{location_id}/{capability_name}".encode()).hexdigest()[:16]
+    return f"{location_id[:8]}.{digest}"[:SUBSCRIPTION_NAME_MAX_LENGTH]
+
+
 class SmartThings:
     def __init__(self, hass, entry = None, config = {}):
         self._hass = hass
         self._entry = entry
         self._config = config
 #         self._data = {}
-        self._session = aiohttp.ClientSession()
+        self._session = async_get_clientsession(hass)
         self._coordinator_dict  = {}
         self._devices  = []
+        self._device_pages = []
+        self._devices_loaded = False
+        self._device_load_error = None
+        self._device_pages_updated = asyncio.Condition()
+        self._device_status = {}
+        self._polled_status = {}
+        self._polled_status_time = None
+        self._bulk_refresh = None
+        self._attribute_index = {}
+        self._refresh_lock = asyncio.Lock()
+        self._refresh_unsub = None
+        self.platforms = []
+        self._store = None
+        self._capability_filter = None
+        self._capability_tiers = None
+        self._pending_commands = {}
+        self._capability_definitions = OrderedDict()
+        self._capability_store = Store(hass, STORAGE_VERSION, f"{STORAGE_KEY}.capabilities")
+        self._capability_store_loaded = False
+        self._memory_report = {} if _LOGGER.isEnabledFor(logging.DEBUG) else None
+        self._event_queue = asyncio.Queue(WEBHOOK_QUEUE_SIZE)
+        self._event_worker = None
+        self._webhook_stats = {"received": 0, "processed": 0, "dropped": 0, "rejected": 0, "max_depth": 0}
+        self._signature_verifier = SignatureVerifier(hass, self._session)
 
+        self.loaded_options = {}
         if self._entry:
             self._config = self._entry.data
+            self.loaded_options = dict(self._entry.options)
+            self._store = Store(hass, STORAGE_VERSION, f"{STORAGE_KEY}.{self._entry.entry_id}")
+
+        # Every request goes to the same host, this caps our share of the shared connection pool
+        self._connection_semaphore = asyncio.Semaphore(self.options.get(OPTION_MAX_CONNECTIONS) or DEFAULT_MAX_CONNECTIONS)
+        self._scheduler = RequestScheduler()
+        self._circuit_breakers = {}
 
         _LOGGER.error(self._config)
 
 
 
-    async def close_session(self):
-        await self._session.close()
+    async def async_unload(self):
+        # The HTTP session is shared and owned by Home Assistant, only our own resources are released
+        self.cancel_token_refresh()
+        if self.webhook_id and self.webhook_id in self._hass.data.get(WEBHOOK_DOMAIN, {}):
+            webhook.async_unregister(self._hass, self.webhook_id)
+        if self._event_worker is not None:
+            self._event_worker.cancel()
+            self._event_worker = None
+        for coordinator in self._coordinator_dict.values():
+            await coordinator.async_shutdown()
 
 
     def get_config(self, name):
@@ -49,17 +168,102 @@ class SmartThings:
         return None
 
 
+    @property
+    def options(self):
+        if not self._entry:
+            return {}
+        return self._entry.options
+
+
+    @property
+    def filter_options(self):
+        return {name: self.options[name] for name in FILTER_OPTIONS if name in self.options}
+
+
+    def get_capability_refresh_tiers(self):
+        # "powerMeter=30, energyMeter=0": seconds per capability, 0 leaves it to the full refresh
+        if self._capability_tiers is None:
+            tiers = dict(DEFAULT_CAPABILITY_REFRESH_TIERS)
+            for item in self.get_option_list(OPTION_CAPABILITY_REFRESH_TIERS):
+                capability_name, _, interval = item.partition("=")
+                try:
+                    tiers[capability_name.strip()] = int(interval)
+                except ValueError:
+                    _LOGGER.warning(f"Invalid capability refresh tier {item}")
+            self._capability_tiers = {capability_name: interval for capability_name, interval in tiers.items() if interval > 0}
+        return self._capability_tiers
+
+
+    def get_option_list(self, name):
+        return frozenset(item.strip() for item in self.options.get(name, "").split(",") if item.strip())
+
+
+    @property
+    def capability_filter(self):
+        if self._capability_filter is None:
+            self._capability_filter = (
+                DISABLED_CAPABILITIES.union(self.get_option_list(OPTION_EXCLUDED_CAPABILITIES)),
+                self.get_option_list(OPTION_INCLUDED_CAPABILITIES),
+                frozenset(self.options.get(OPTION_CAPABILITY_FAMILIES, []))
+            )
+        return self._capability_filter
+
+
+    def is_device_included(self, device):
+        for option, value in [
+            (OPTION_LOCATIONS, device.get("locationId")),
+            (OPTION_ROOMS, device.get("roomId")),
+            (OPTION_DEVICE_TYPES, get_device_type(device))
+        ]:
+            if self.options.get(option) and value not in self.options[option]:
+                return False
+        return True
+
+
+    async def async_get_filter_choices(self):
+        await self.get_refresh_token()
+        choices = {
+            OPTION_LOCATIONS: {},
+            OPTION_ROOMS: {},
+            OPTION_DEVICE_TYPES: {},
+            OPTION_CAPABILITY_FAMILIES: {}
+        }
+
+        locations = await self.make_http_request(f"{API_BASE_URL}/locations", 'GET', self.headers_baerer_auth)
+        for location in locations.get("items", []):
+            choices[OPTION_LOCATIONS][location["locationId"]] = location["name"]
+            rooms = await self.make_http_request(f"{API_BASE_URL}/locations/{location['locationId']}/rooms", 'GET', self.headers_baerer_auth)
+            for room in rooms.get("items", []):
+                choices[OPTION_ROOMS][room["roomId"]] = f"{location['name']} - {room['name']}"
+
+        url =  f"{API_BASE_URL}/v1/devices"
+        while url:
+            request = await self.make_http_request(url, 'GET', self.headers_baerer_auth)
+            for device in request.get("items", []):
+                device_type = get_device_type(device)
+                if device_type:
+                    choices[OPTION_DEVICE_TYPES][device_type] = device_type
+                for component in device.get("components", []):
+                    for capability in component.get("capabilities", []):
+                        family = get_capability_family(capability["id"])
+                        choices[OPTION_CAPABILITY_FAMILIES][family] = family
+            url = (request.get("_links") or {}).get("next", {}).get("href")
+
+        return choices
+
+
     def save_config(self, name, value):
-        data = self._config
-        new_data = {}
-        for key in data:
-            new_data[key] = deepcopy(data[key])
-        if name not in new_data:
-            new_data[name] = None
-        new_data[name] = value
-        self._hass.config_entries.async_update_entry(self._entry, data=new_data)
-        self._hass.config_entries._async_schedule_save()
+        self.save_configs({name: value})
+
+
+    def save_configs(self, values):
+        if all(name in self._config and self._config[name] == value for name, value in values.items()):
+            return
+        # Shallow merge: untouched values are shared, the entry schedules one debounced save
+        new_data = {**self._config, **values}
         self._config = new_data
+        if self._entry:
+            self._hass.config_entries.async_update_entry(self._entry, data=new_data)
 
 
     @property
@@ -113,19 +317,73 @@ class SmartThings:
         }
 
 
-    async def make_http_request(self, url, method = 'GET', headers = None, params = None, json = None, data = None):
-        _LOGGER.debug("---------- START make_http_request")
-        _LOGGER.debug(url)
-        _LOGGER.debug(method)
-        _LOGGER.debug(headers)
-        _LOGGER.debug(params)
-        _LOGGER.debug(json)
-        _LOGGER.debug(data)
+    async def make_http_request(self, url, method = 'GET', headers = None, params = None, json = None, data = None, priority = PRIORITY_DEFAULT):
+        family = self.get_endpoint_family(url)
+        breaker = self._circuit_breakers.setdefault(family, CircuitBreaker(family))
+        attempts = RETRY_ATTEMPTS if method in IDEMPOTENT_METHODS else 1
+
+        for attempt in range(attempts):
+            if not breaker.allow():
+                raise SmartThingsCircuitOpenError(f"SmartThings {family} endpoints are failing, request skipped")
+            try:
+                result = await self._make_http_request(url, method, headers, params, json, data, priority)
+            except (SmartThingsRetryableError, aiohttp.ClientError, asyncio.TimeoutError) as e:
+                if not isinstance(e, SmartThingsRateLimitError):
+                    breaker.record_failure()
+                if attempt + 1 >= attempts:
+                    raise
+                delay = getattr(e, "retry_after", None) or random.uniform(0, min(RETRY_MAX_DELAY, RETRY_BASE_DELAY * 2 ** attempt))
+                _LOGGER.debug(f"{method} {url} failed ({type(e).__name__}), retry {attempt + 1} in {delay:.1f}s")
+                await asyncio.sleep(delay)
+                continue
+            except SmartThingsApiError:
+                # The endpoint answered, the request itself was refused
+                breaker.record_success()
+                raise
+            breaker.record_success()
+            return result
+
+
+    def get_endpoint_family(self, url):
+        if "/oauth/" in url:
+            return "oauth"
+        if url.endswith("/status"):
+            return "status"
+        if "/devices" in url:
+            return "devices"
+        return "other"
+
+
+    async def _make_http_request(self, url, method, headers, params, json, data, priority):
+        debug = _LOGGER.isEnabledFor(logging.DEBUG)
+        if debug:
+            _LOGGER.debug("---------- START make_http_request")
+            _LOGGER.debug(url)
+            _LOGGER.debug(method)
+            _LOGGER.debug(headers)
+            _LOGGER.debug(params)
+            _LOGGER.debug(json)
+            _LOGGER.debug(data)
         result = {}
         error = None
-        async with self._session.request(method, url, params=params, json=json, data=data, headers=headers) as resp:
-            if method != "DELETE" and (await resp.text()):
-                result = await resp.json()
+        await self._scheduler.acquire(priority)
+        async with self._connection_semaphore, self._session.request(method, url, params=params, json=json, data=data, headers=headers, timeout=REQUEST_TIMEOUT) as resp:
+            self._scheduler.update_from_headers(resp.headers)
+            retry_after = resp.headers.get("Retry-After")
+            retry_after = int(retry_after) if retry_after and retry_after.isdigit() else None
+            if resp.status == 429:
+                self._scheduler.block(retry_after or 60)
+                raise SmartThingsRateLimitError(f"{method} request rate limited: {resp.url}", retry_after or 60)
+            if resp.status >= 500:
+                raise SmartThingsServerError(f"{method} request error {str(resp.status)}: {resp.url}", retry_after)
+            if method != "DELETE":
+                # Read the body once and decode it once
+                body = await resp.read()
+                if body:
+                    try:
+                        result = json_loads(body)
+                    except ValueError:
+                        error = f"{method} request invalid response {str(resp.status)}: {resp.url}"
             if not str(resp.status).startswith("20"):
                 _LOGGER.error(f"{method} request error {str(resp.status)}: {resp.url}")
 
@@ -136,45 +394,123 @@ class SmartThings:
                         for detail in result["error"]["details"]:
                             error = error + f" - ({detail["code"]}) {detail["message"]}."
 
-        _LOGGER.debug(result)
-        _LOGGER.debug("---------- END make_http_request")
+        if debug:
+            _LOGGER.debug(result)
+            _LOGGER.debug("---------- END make_http_request")
 
 #             if str(resp.status) == "400" and "error" in result and result["error"] == "invalid_grant":
 #                 # Token expiration
 #                 raise ConfigEntryAuthFailed(error)
         if error:
             # Generic error
-            raise Exception(error)
+            raise SmartThingsApiError(error)
         return result
 
 
     async def _handle_webhook(self, hass, webhook_id, request):
-        _LOGGER.debug("---------- START _handle_webhook")
-        body = await request.json()
-        _LOGGER.debug(body)
-        if "lifecycle" in body:
-#             if body["lifecycle"] == "CONFIRMATION":
-#                 if "confirmationData" in body and "confirmationUrl" in body["confirmationData"]:
-#                     self._data.update({"confirmationUrl": body["confirmationData"]["confirmationUrl"]})
-#                     return None
-            if body["lifecycle"] == "PING":
-                return json.dumps({"pingData": body["pingData"]})
-        return await request.text()
+        # SmartThings disables slow webhooks: answer right away, events are applied by the worker
+        raw_body = await request.read()
+        # Apps created before signatures were requested keep working unsigned
+        if self.get_config(FIELD_SIGNATURE_TYPE) and not await self._signature_verifier.verify(request, raw_body):
+            self._webhook_stats["rejected"] = self._webhook_stats["rejected"] + 1
+            return web.Response(status=401)
+        try:
+            body = json_loads(raw_body)
+        except ValueError:
+            return web.Response(status=400)
+        _LOGGER.debug(f"Webhook {body.get('lifecycle')} received")
+
+        lifecycle = body.get("lifecycle")
+        if lifecycle == "PING":
+            return web.json_response({"pingData": body.get("pingData")})
+        if lifecycle == "CONFIRMATION":
+            confirmation_url = body.get("confirmationData", {}).get("confirmationUrl")
+            if confirmation_url:
+                self._hass.async_create_background_task(self.confirm_app(confirmation_url), "smartthings_app_confirmation")
+            return web.json_response({"targetUrl": self.webhook_url})
+        if lifecycle == "EVENT":
+            self.queue_events(body.get("eventData", {}).get("events", []))
+        return web.json_response({})
+
+
+    async def confirm_app(self, confirmation_url):
+        try:
+            async with self._session.get(confirmation_url, timeout=REQUEST_TIMEOUT) as response:
+                _LOGGER.debug(f"Webhook confirmation returned {response.status}")
+        except Exception as error:
+            _LOGGER.warning(f"Webhook confirmation failed: {error}")
+
+
+    def queue_events(self, events):
+        self._webhook_stats["received"] = self._webhook_stats["received"] + 1
+        try:
+            self._event_queue.put_nowait(events)
+        except asyncio.QueueFull:
+            self._webhook_stats["dropped"] = self._webhook_stats["dropped"] + 1
+            _LOGGER.warning(f"Webhook event queue full, dropped {len(events)} events")
+            return
+        self._webhook_stats["max_depth"] = max(self._webhook_stats["max_depth"], self._event_queue.qsize())
+
+        if self._event_worker is None or self._event_worker.done():
+            self._event_worker = self._hass.async_create_background_task(self._async_process_events(), "smartthings_app_events")
+
+
+    async def _async_process_events(self):
+        while True:
+            events = await self._event_queue.get()
+            try:
+                self.async_handle_events(events)
+                self._webhook_stats["processed"] = self._webhook_stats["processed"] + 1
+            except Exception as error:
+                _LOGGER.exception(f"Failed to apply webhook events: {error}")
+            finally:
+                self._event_queue.task_done()
+
+
+    def register_device_attributes(self, coordinator):
+        device_id = coordinator._device["deviceId"]
+        for component_name, capability_name, attribute_name in coordinator.get_device_attributes():
+            self._attribute_index[(device_id, component_name, capability_name, attribute_name)] = coordinator
+
+
+    def async_handle_events(self, events):
+        updates = {}
+        for event in events:
+            if event.get("eventType") != "DEVICE_EVENT" or "deviceEvent" not in event:
+                continue
+            device_event = event["deviceEvent"]
+            key = (
+                device_event.get("deviceId"),
+                device_event.get("componentId"),
+                device_event.get("capability"),
+                device_event.get("attribute")
+            )
+            coordinator = self._attribute_index.get(key)
+            if coordinator is None or device_event.get("value") is None:
+                continue
+
+            item_data = AttributeState(device_event.get("value"), device_event.get("unit"), event.get("eventTime"))
+            updates.setdefault(coordinator, {})[key[1:]] = item_data
+
+        for coordinator, coordinator_updates in updates.items():
+            coordinator.async_apply_updates(coordinator_updates)
 
 
     def register_webhook(self):
         if not self.webhook_id:
             return False
-        if not self.webhook_id in self._hass.data.setdefault(WEBHOOK_DOMAIN, {}):
-            webhook.async_register(self._hass, DOMAIN, "SmartThings App", self.webhook_id, self._handle_webhook)
+        # The config flow registers its own instance for the same id, events must reach this one
+        if self.webhook_id in self._hass.data.setdefault(WEBHOOK_DOMAIN, {}):
+            webhook.async_unregister(self._hass, self.webhook_id)
+        webhook.async_register(self._hass, DOMAIN, "SmartThings App", self.webhook_id, self._handle_webhook)
+        return True
 
 
     async def create_app(self):
         if not self.webhook_url or not self.personal_token:
             return False
 
-#         url =  f"{API_BASE_URL}/apps?requireConfirmation=true&signatureType=APP_RSA"
-        url =  f"{API_BASE_URL}/apps"
+        url =  f"{API_BASE_URL}/apps?signatureType={SIGNATURE_TYPE}"
         name = f"Home Assistant for {self.hass_url}"
         payload = {
             "appName": f"hass.{self.webhook_id}",
@@ -194,8 +530,10 @@ class SmartThings:
               "dashboardCardsEnabled": False,
               "preInstallDashboardCardsEnabled": False
             },
-            "webhookSmartApp": {
-              "targetUrl": self.webhook_url
+            "apiOnly": {
+              "subscription": {
+                "targetUrl": self.webhook_url
+              }
             }
         }
         request = await self.make_http_request(url, 'POST', self.headers_personal_token, None, payload)
@@ -204,24 +542,37 @@ class SmartThings:
 
 #         if "confirmationUrl" in self._data:
 #             await self.make_http_request(self._data["confirmationUrl"])
-        return {"app_id": request["app"]["appId"], "client_id": request["oauthClientId"], "client_secret": request["oauthClientSecret"]}
+        return {"app_id": request["app"]["appId"], "client_id": request["oauthClientId"], "client_secret": request["oauthClientSecret"], FIELD_SIGNATURE_TYPE: SIGNATURE_TYPE, "app_webhook_url": self.webhook_url}
 
 
-#     async def update_app(self):
-#         if not self.get_config("app_id"):
-#             return False
-#         url =  f"{API_BASE_URL}/apps/{self.get_config("app_id")}"
-#         name = f"Home Assistant for {self.hass_url}"
-#         payload = {
-#             "appType": "WEBHOOK_SMART_APP",
-#             "classifications": ["CONNECTED_SERVICE"],
-#             "displayName": name,
-#             "description": name,
-#             "webhookSmartApp": {
-#               "targetUrl": self.webhook_url
-#             }
-#         }
-#         request = await self.make_http_request(url, 'PUT', self.headers_personal_token, None, payload)
+    async def update_app(self, signature_type = None):
+        if not self.get_config("app_id") or not self.personal_token:
+            return False
+        signature_type = signature_type or self.get_config(FIELD_SIGNATURE_TYPE)
+        # API only apps get their subscription events on apiOnly.subscription.targetUrl, moving it follows a new address
+        url =  f"{API_BASE_URL}/apps/{self.get_config('app_id')}"
+        if signature_type:
+            url = f"{url}?signatureType={signature_type}"
+        name = f"Home Assistant for {self.hass_url}"
+        payload = {
+            "appName": f"hass.{self.webhook_id}",
+            "appType": "API_ONLY",
+            "classifications": ["CONNECTED_SERVICE"],
+            "displayName": name,
+            "description": name,
+            "singleInstance": True,
+            "ui": {
+              "dashboardCardsEnabled": False,
+              "preInstallDashboardCardsEnabled": False
+            },
+            "apiOnly": {
+              "subscription": {
+                "targetUrl": self.webhook_url
+              }
+            }
+        }
+        await self.make_http_request(url, 'PUT', self.headers_personal_token, None, payload)
+        return True
 
 
     async def delete_app(self):
@@ -253,44 +604,559 @@ class SmartThings:
             "code": code,
             "redirect_uri": self.get_config("redirect_uri")
         }
-        return await self.make_http_request(url, 'POST', self.headers_basic_auth, None, None, payload)
+        return await self.make_http_request(url, 'POST', self.headers_basic_auth, None, None, payload, PRIORITY_TOKEN)
+
 
+    def is_token_expiring(self):
+        return time.time() >= (self.get_config("expires_in") - 10)
 
-    async def get_refresh_token(self):
-        if time.time() < (self.get_config("expires_in") - 10):
+
+    async def get_refresh_token(self, force = False):
+        if not force and not self.is_token_expiring():
             return
 
-        url =  f"{API_BASE_URL}/oauth/token"
-        payload = {
-            "grant_type": "refresh_token",
-            "client_id": self.get_config("client_id"),
-            "refresh_token": self.get_config("refresh_token"),
-            "redirect_uri": self.get_config("redirect_uri")
-        }
-        refresh_token_request = await self.make_http_request(url, 'POST', self.headers_basic_auth, None, None, payload)
-        self.save_config("access_token", refresh_token_request["access_token"])
-        self.save_config("refresh_token", refresh_token_request["refresh_token"])
-        self.save_config("expires_in", time.time() + int(refresh_token_request["expires_in"]))
+        # Single flight: concurrent callers wait for the refresh already in progress
+        async with self._refresh_lock:
+            if not force and not self.is_token_expiring():
+                return
+            # A forced refresh that queued behind another one finds a token good past the margin
+            if force and time.time() < self.get_config("expires_in") - TOKEN_REFRESH_MARGIN.total_seconds():
+                return
 
+            url =  f"{API_BASE_URL}/oauth/token"
+            payload = {
+                "grant_type": "refresh_token",
+                "client_id": self.get_config("client_id"),
+                "refresh_token": self.get_config("refresh_token"),
+                "redirect_uri": self.get_config("redirect_uri")
+            }
+            refresh_token_request = await self.make_http_request(url, 'POST', self.headers_basic_auth, None, None, payload, PRIORITY_TOKEN)
+            values = {
+                "access_token": refresh_token_request["access_token"],
+                "refresh_token": refresh_token_request["refresh_token"],
+                "expires_in": time.time() + int(refresh_token_request["expires_in"])
+            }
+            if "installed_app_id" in refresh_token_request:
+                values["installed_app_id"] = refresh_token_request["installed_app_id"]
+            self.save_configs(values)
+
+        self.schedule_token_refresh()
+
+
+    def schedule_token_refresh(self, when = None):
+        self.cancel_token_refresh()
+        if not self._entry or not self.get_config("expires_in"):
+            return
+        if when is None:
+            when = dt.utc_from_timestamp(self.get_config("expires_in") - TOKEN_REFRESH_MARGIN.total_seconds())
+        self._refresh_unsub = async_track_point_in_time(self._hass, self._async_scheduled_token_refresh, when)
+
+
+    def cancel_token_refresh(self):
+        if self._refresh_unsub:
+            self._refresh_unsub()
+            self._refresh_unsub = None
+
+
+    async def _async_scheduled_token_refresh(self, now):
+        self._refresh_unsub = None
+        try:
+            await self.get_refresh_token(True)
+        except Exception as e:
+            _LOGGER.error(f"Scheduled token refresh failed: {str(e)}")
+            self.schedule_token_refresh(dt.utcnow() + TOKEN_REFRESH_RETRY)
+
+
+    def get_capability_definition(self, capability_id, version):
+        key = f"{capability_id}/{version}"
+        definition = self._capability_definitions.get(key)
+        if definition is None or "unavailable_until" in definition:
+            return None
+        self._capability_definitions.move_to_end(key)
+        return definition
+
+
+    async def async_load_capability_definitions(self, devices = None):
+        if not self._capability_store_loaded:
+            self._capability_store_loaded = True
+            self._capability_definitions.update(await self._capability_store.async_load() or {})
+
+        missing = set()
+        for device in (self._devices if devices is None else devices):
+            for component in device.get("components", []):
+                for capability in component.get("capabilities", []):
+                    key = f"{capability['id']}/{capability.get('version', 1)}"
+                    definition = self._capability_definitions.get(key)
+                    if definition is None or definition.get("unavailable_until", float("inf")) < time.time():
+                        missing.add(key)
+        if not missing:
+            return
 
-    async def get_devices(self):
         await self.get_refresh_token()
+        semaphore = asyncio.Semaphore(self.options.get(OPTION_STATUS_CONCURRENCY) or DEFAULT_STATUS_CONCURRENCY)
 
-        if self._devices:
-            return self._devices
+        async def fetch(key):
+            async with semaphore:
+                try:
+                    definition = await self.make_http_request(f"{API_BASE_URL}/capabilities/{key}", 'GET', self.headers_baerer_auth, priority = PRIORITY_PREFETCH)
+                except Exception as e:
+                    _LOGGER.debug(f"Capability definition {key} not available: {str(e)}")
+                    # Private and custom capabilities often answer 403 or 404, don't ask again on every load
+                    self._capability_definitions[key] = {"unavailable_until": time.time() + CAPABILITY_RETRY_DELAY}
+                    return
+            # Only what the entity builder reads is kept
+            self._capability_definitions[key] = {"attributes": {
+                attribute_name: {"schema": attribute.get("schema", {})}
+                for attribute_name, attribute in definition.get("attributes", {}).items()
+            }}
 
-        url =  f"{API_BASE_URL}/v1/devices"
-        request = await self.make_http_request(url, 'GET', self.headers_baerer_auth)
-        if not "items" in request:
-            return []
-        self._devices = request["items"]
+        await asyncio.gather(*[fetch(key) for key in missing])
+
+        while len(self._capability_definitions) > CAPABILITY_CACHE_SIZE:
+            self._capability_definitions.popitem(last=False)
+        self._capability_store.async_delay_save(lambda: dict(self._capability_definitions), CACHE_SAVE_DELAY)
+        _LOGGER.debug(f"Fetched {len(missing)} capability definitions")
+
+
+    async def async_load_cache(self):
+        if not self._store:
+            return False
+        cache = await self._store.async_load()
+        if not cache or not cache.get("devices"):
+            return False
+        if cache.get("options", {}) != self.filter_options:
+            # Written with other filters, the cached components don't match them
+            return False
+
+        self._devices = [compact_device(device) for device in cache["devices"]]
+        self._device_pages = [self._devices]
+        self._devices_loaded = True
+        self._capability_store_loaded = True
+        self._capability_definitions.update(await self._capability_store.async_load() or {})
+        for device in self._devices:
+            coordinator = await self.async_get_coordinator(device)
+            coordinator.load_device_components(components_from_cache(cache["components"].get(device["deviceId"], {})))
+        _LOGGER.debug(f"Loaded {len(self._devices)} devices from cache")
+        return True
+
+
+    def save_cache(self):
+        if self._store and self._devices_loaded:
+            self._store.async_delay_save(self._cache_data, CACHE_SAVE_DELAY)
+
+
+    def _cache_data(self):
+        return {
+            "options": self.filter_options,
+            "devices": self._devices,
+            "components": {
+                device_id: components_as_cache(coordinator._device_components)
+                for device_id, coordinator in self._coordinator_dict.items()
+            }
+        }
+
+
+    async def async_remove_cache(self):
+        if self._store:
+            await self._store.async_remove()
+
+
+    async def async_load_devices(self):
+        # On the first load every page is handed to the platforms as soon as its status is known
+        publish = not self._devices_loaded
+        devices = []
+        try:
+            async for page in self.fetch_device_pages():
+                pending_devices = []
+
+                for device in page:
+                    coordinator = await self.async_get_coordinator(device)
+                    coordinator._device = device
+                    status = self.pop_device_status(device["deviceId"])
+                    if status:
+                        coordinator.set_device_status(status)
+                    else:
+                        pending_devices.append(device)
+
+                if pending_devices:
+                    await self.prefetch_device_status(pending_devices)
+
+                try:
+                    await self.async_load_capability_definitions(page)
+                except Exception as e:
+                    _LOGGER.error(f"Capability definitions load failed: {str(e)}")
+
+                devices.extend(page)
+                if publish:
+                    self._devices = devices
+                    await self.publish_device_page(page)
+        except Exception as e:
+            if publish:
+                async with self._device_pages_updated:
+                    self._device_load_error = e
+                    self._device_pages_updated.notify_all()
+            raise
+
+        async with self._device_pages_updated:
+            self._devices = devices
+            self._devices_loaded = True
+            self._device_pages_updated.notify_all()
+
+        if self._memory_report is not None:
+            _LOGGER.debug(f"Memory report: {self.memory_report()}")
+
+        self.save_cache()
         return self._devices
 
 
-    async def get_device_status(self, device_id):
+    async def publish_device_page(self, page):
+        async with self._device_pages_updated:
+            self._device_pages.append(page)
+            self._device_pages_updated.notify_all()
+        async_dispatcher_send(self._hass, self.device_page_signal, page)
+
+
+    async def async_revalidate(self):
+        cached_device_ids = set(self._coordinator_dict)
+        try:
+            devices = await self.async_load_devices()
+        except Exception as e:
+            _LOGGER.error(f"Devices revalidation failed: {str(e)}")
+            return
+
+        if {device["deviceId"] for device in devices} != cached_device_ids:
+            # Devices were added or removed since the cache was written, rebuild the entities
+            _LOGGER.info("SmartThings devices changed, reloading")
+            # A reload doesn't flush the delayed save, the next instance must not read the stale list
+            if self._store:
+                await self._store.async_save(self._cache_data())
+            self._hass.config_entries.async_schedule_reload(self._entry.entry_id)
+
+
+    async def async_wait_for_devices(self):
+        # Returns as soon as one device is ready, or once the whole list turned out empty
+        async with self._device_pages_updated:
+            await self._device_pages_updated.wait_for(
+                lambda: self._devices or self._devices_loaded or self._device_load_error is not None
+            )
+        if not self._devices and self._device_load_error is not None:
+            raise self._device_load_error
+        return bool(self._devices)
+
+
+    @property
+    def device_page_signal(self):
+        return f"{DOMAIN}_{self._entry.entry_id}_device_page"
+
+
+    @callback
+    def async_subscribe_device_pages(self, async_add_page):
+        # Pages already loaded are added right away, later ones as the load publishes them
+        @callback
+        def add_page(page):
+            self._hass.async_create_task(async_add_page(page))
+
+        unsubscribe = async_dispatcher_connect(self._hass, self.device_page_signal, add_page)
+        for page in self._device_pages:
+            add_page(page)
+        return unsubscribe
+
+
+    async def fetch_device_pages(self, priority = PRIORITY_DEFAULT):
+        await self.get_refresh_token()
+
+        url =  f"{API_BASE_URL}/v1/devices"
+        params = []
+        if self.options.get(OPTION_BULK_STATUS):
+            params.append(("includeStatus", "true"))
+        # The location filter is applied by the API
+        for location_id in self.options.get(OPTION_LOCATIONS, []):
+            params.append(("locationId", location_id))
+
+        while url:
+            request = await self.make_http_request(url, 'GET', self.headers_baerer_auth, params, priority = priority)
+            page = []
+
+            for device in request.get("items", []):
+                if not self.is_device_included(device):
+                    continue
+                status = self.extract_device_status(device)
+                if status:
+                    self._device_status[device["deviceId"]] = status
+                if self._memory_report is not None and not self._devices_loaded:
+                    self._memory_report["raw_devices"] = self._memory_report.get("raw_devices", 0) + deep_getsizeof(device)
+                page.append(compact_device(device))
+
+            # The next link already carries the query string
+            params = None
+            url = (request.get("_links") or {}).get("next", {}).get("href")
+            # Only the compact devices outlive the raw page
+            del request
+            yield page
+
+
+    def extract_device_status(self, device):
+        components = {}
+        for component in device.get("components", []):
+            if "status" in component:
+                components[component["id"]] = component.pop("status")
+        if not components:
+            return None
+        return {"components": components}
+
+
+    def pop_device_status(self, device_id):
+        return self._device_status.pop(device_id, None)
+
+
+    async def get_polled_device_status(self, device_id, priority = PRIORITY_POLL):
+        if not self.options.get(OPTION_BULK_STATUS):
+            return await self.get_device_status(device_id, priority)
+
+        # One paged device list with status serves every device polled within BULK_STATUS_MAX_AGE
+        if self._polled_status_time is None or time.monotonic() - self._polled_status_time > BULK_STATUS_MAX_AGE:
+            if self._bulk_refresh is None:
+                self._bulk_refresh = self._hass.async_create_task(self._async_bulk_refresh(priority))
+            await asyncio.shield(self._bulk_refresh)
+
+        status = self._polled_status.pop(device_id, None)
+        if status is None:
+            # Already used by an earlier poll of the same device, or missing from the list
+            return await self.get_device_status(device_id, priority)
+        return status
+
+
+    async def _async_bulk_refresh(self, priority):
+        try:
+            polled_status = {}
+            async for page in self.fetch_device_pages(priority):
+                for device in page:
+                    status = self.pop_device_status(device["deviceId"])
+                    if status:
+                        polled_status[device["deviceId"]] = status
+            self._polled_status = polled_status
+            self._polled_status_time = time.monotonic()
+            _LOGGER.debug(f"Bulk refreshed status of {len(polled_status)} devices")
+        finally:
+            self._bulk_refresh = None
+
+
+    async def get_device_status(self, device_id, priority = PRIORITY_DEFAULT):
         await self.get_refresh_token()
         url =  f"{API_BASE_URL}/v1/devices/{device_id}/status"
-        return await self.make_http_request(url, 'GET', self.headers_baerer_auth)
+        return await self.make_http_request(url, 'GET', self.headers_baerer_auth, priority = priority)
+
+
+    async def get_capability_status(self, device_id, component_id, capability_id, priority = PRIORITY_DEFAULT):
+        await self.get_refresh_token()
+        url =  f"{API_BASE_URL}/v1/devices/{device_id}/components/{component_id}/capabilities/{capability_id}/status"
+        return await self.make_http_request(url, 'GET', self.headers_baerer_auth, priority = priority)
+
+
+    async def async_send_command(self, device_id, component_id, capability_id, command, arguments = None):
+        batch = self._pending_commands.get(device_id)
+        if batch is None:
+            batch = self._pending_commands[device_id] = {"commands": {}, "futures": []}
+            self._hass.loop.call_later(COMMAND_COALESCE_WINDOW, self._flush_commands, device_id)
+
+        payload = {"component": component_id, "capability": capability_id, "command": command}
+        if arguments:
+            payload["arguments"] = arguments
+        # Only a repeat of the same command replaces the earlier one, setHue and setSaturation both go out in order
+        key = (component_id, capability_id, command)
+        batch["commands"].pop(key, None)
+        batch["commands"][key] = payload
+
+        future = self._hass.loop.create_future()
+        batch["futures"].append(future)
+        await future
+
+
+    def _flush_commands(self, device_id):
+        batch = self._pending_commands.pop(device_id)
+        self._hass.async_create_task(self._async_send_commands(device_id, list(batch["commands"].values()), batch["futures"]))
+
+
+    async def _async_send_commands(self, device_id, commands, futures):
+        try:
+            await self.get_refresh_token()
+            url =  f"{API_BASE_URL}/v1/devices/{device_id}/commands"
+            await self.make_http_request(url, 'POST', self.headers_baerer_auth, None, {"commands": commands}, priority = PRIORITY_COMMAND)
+        except Exception as e:
+            for future in futures:
+                if not future.done():
+                    future.set_exception(e)
+            return
+        for future in futures:
+            if not future.done():
+                future.set_result(None)
+
+
+    async def get_installed_app_id(self):
+        if self.get_config("installed_app_id"):
+            return self.get_config("installed_app_id")
+        if not self.get_config("app_id"):
+            return None
+
+        await self.get_refresh_token()
+        url =  f"{API_BASE_URL}/installedapps"
+        request = await self.make_http_request(url, 'GET', self.headers_baerer_auth, {"appId": self.get_config("app_id")})
+        if not request.get("items"):
+            return None
+        self.save_config("installed_app_id", request["items"][0]["installedAppId"])
+        return self.get_config("installed_app_id")
+
+
+    async def get_subscriptions(self, installed_app_id):
+        url =  f"{API_BASE_URL}/installedapps/{installed_app_id}/subscriptions"
+        request = await self.make_http_request(url, 'GET', self.headers_baerer_auth)
+        return request.get("items", [])
+
+
+    async def create_subscription(self, installed_app_id, payload):
+        url =  f"{API_BASE_URL}/installedapps/{installed_app_id}/subscriptions"
+        return await self.make_http_request(url, 'POST', self.headers_baerer_auth, None, payload)
+
+
+    async def delete_subscription(self, installed_app_id, subscription_id):
+        url =  f"{API_BASE_URL}/installedapps/{installed_app_id}/subscriptions/{subscription_id}"
+        await self.make_http_request(url, 'DELETE', self.headers_baerer_auth)
+
+
+    def get_desired_subscriptions(self):
+        capabilities = {}
+        for (device_id, component_name, capability_name, attribute_name), coordinator in self._attribute_index.items():
+            location_id = coordinator._device.get("locationId")
+            if location_id:
+                capabilities.setdefault(location_id, set()).add(capability_name)
+
+        per_capability = sum(len(location_capabilities) for location_capabilities in capabilities.values())
+
+        subscriptions = {}
+        for location_id, location_capabilities in capabilities.items():
+            # Fall back to one location wide subscription when the per capability ones don't fit
+            if per_capability > SUBSCRIPTION_LIMIT:
+                location_capabilities = ["*"]
+            for capability_name in location_capabilities:
+                name = get_subscription_name(location_id, capability_name)
+                subscriptions[name] = {
+                    "sourceType": "CAPABILITY",
+                    "capability": {
+                        "locationId": location_id,
+                        "capability": capability_name,
+                        "attribute": "*",
+                        "value": "*",
+                        "stateChangeOnly": True,
+                        "subscriptionName": name
+                    }
+                }
+        return subscriptions
+
+
+    async def async_update_app_settings(self):
+        # Subscriptions don't carry a url, events follow the app subscription target url.
+        # Apps created before signatures were requested are switched over here as well.
+        if self.get_config(FIELD_SIGNATURE_TYPE) and self.get_config("app_webhook_url") == self.webhook_url:
+            return
+        try:
+            if await self.update_app(SIGNATURE_TYPE):
+                self.save_configs({"app_webhook_url": self.webhook_url, FIELD_SIGNATURE_TYPE: SIGNATURE_TYPE})
+        except Exception as e:
+            _LOGGER.error(f"App update failed, webhook requests stay unverified: {str(e)}")
+
+
+    async def async_reconcile_subscriptions(self):
+        try:
+            installed_app_id = await self.get_installed_app_id()
+            if not installed_app_id:
+                _LOGGER.warning("Installed app not found, device events will not be pushed")
+                return False
+
+            await self.async_update_app_settings()
+
+            await self.get_refresh_token()
+            desired = self.get_desired_subscriptions()
+            existing = {}
+            for subscription in await self.get_subscriptions(installed_app_id):
+                source = subscription.get(subscription.get("sourceType", "").lower(), {})
+                existing[source.get("subscriptionName", subscription["id"])] = subscription["id"]
+
+
+            for name, subscription_id in existing.items():
+                if name not in desired:
+                    await self.delete_subscription(installed_app_id, subscription_id)
+
+            created = 0
+            for name, payload in desired.items():
+                if name not in existing:
+                    await self.create_subscription(installed_app_id, payload)
+                    _LOGGER.debug(f"Subscribed {name} to {payload['capability']['capability']}")
+                    created = created + 1
+
+            _LOGGER.debug(f"Subscriptions reconciled: {len(desired)} active, {created} created")
+        except Exception as e:
+            _LOGGER.error(f"Subscriptions reconcile failed: {str(e)}")
+            return False
+        return True
+
+
+    async def prefetch_device_status(self, devices):
+        await self.get_refresh_token()
+
+        concurrency = self.options.get(OPTION_STATUS_CONCURRENCY) or DEFAULT_STATUS_CONCURRENCY
+        semaphore = asyncio.Semaphore(concurrency)
+        start = time.monotonic()
+
+        async def prefetch(device):
+            coordinator = await self.async_get_coordinator(device)
+            async with semaphore:
+                device_start = time.monotonic()
+                try:
+                    request = await self.get_device_status(device["deviceId"], PRIORITY_PREFETCH)
+                except Exception as e:
+                    _LOGGER.error(f"Status prefetch failed for {device['deviceId']}: {str(e)}")
+                    return 0
+                coordinator.set_device_status(request)
+                return time.monotonic() - device_start
+
+        durations = await asyncio.gather(*[prefetch(device) for device in devices])
+
+        _LOGGER.info(
+            "Prefetched status for %s devices in %.2fs (sequential estimate %.2fs, concurrency %s)",
+            len(devices),
+            time.monotonic() - start,
+            sum(durations),
+            concurrency
+        )
+
+
+    def memory_report(self):
+        compact_components = [coordinator._device_components for coordinator in self._coordinator_dict.values()]
+        report = {
+            "devices": len(self._devices),
+            "compact_devices": deep_getsizeof(self._devices),
+            "compact_components": deep_getsizeof(compact_components),
+            # The same state as plain dicts, as it was kept before
+            "dict_components": deep_getsizeof([components_as_dict(components) for components in compact_components])
+        }
+        if self._memory_report and "raw_devices" in self._memory_report:
+            report["raw_devices"] = self._memory_report["raw_devices"]
+        return report
+
+
+    @property
+    def request_stats(self):
+        return self._scheduler.stats
+
+
+    @property
+    def webhook_stats(self):
+        return dict(self._webhook_stats, queue_depth=self._event_queue.qsize())
+
+
+    @property
+    def circuit_states(self):
+        return {family: breaker.state for family, breaker in self._circuit_breakers.items()}
 
 
     async def async_get_coordinator_by_device_id(self, device_id):
@@ -0,0 +1,33 @@
+import logging
+
+from homeassistant.core import HomeAssistant
+from homeassistant.config_entries import ConfigEntry
+from homeassistant.components.switch import SwitchEntityDescription
+
+from .base import SmartthingsSwitch
+from .const import (
+   DOMAIN
+)
+
+_LOGGER = logging.getLogger(__name__)
+
+async def async_setup_entry(hass: HomeAssistant, config: ConfigEntry, async_add_entities):
+    smartthings = hass.data[DOMAIN][config.entry_id]
+
+    async def async_add_page(devices):
+        entities = []
+        for device in devices:
+            coordinator = await smartthings.async_get_coordinator(device)
+            switches = await coordinator.get_device_entities("switch")
+            for switch in switches:
+                description = SwitchEntityDescription(
+                    key = switch["name"],
+                    name = switch["name"],
+                    translation_key = switch["name"]
+                )
+                entities.extend([SmartthingsSwitch(coordinator, description, switch)])
+
+        async_add_entities(entities)
+
+    # Entities of later pages are added as the background load publishes them
+    config.async_on_unload(smartthings.async_subscribe_device_pages(async_add_page))